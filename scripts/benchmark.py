@@ -0,0 +1,510 @@
+#!/usr/bin/env python2
+# Benchmarks for the extraction pipeline on a synthetic sdewac-like corpus.
+
+import argparse
+import bisect
+import functools
+import gzip
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import calculate_chi_squared
+import columnar
+import dedup
+import dependency
+import extract_tuples
+import fan_out
+import progress
+import sampling
+from heavy_hitters import SpaceSavingCounter
+
+TRIGGERS = [("hoffen", "+"), ("wollen", "+"), ("sehen", "-"), ("kritisieren", "-"),
+        ("verlangen", "+"), ("fuerchten", "-"), ("loben", "+"), ("bedauern", "-")]
+
+class ZipfSampler:
+    def __init__(self, rng, size, exponent = 1.1):
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, size + 1):
+            total += 1.0 / rank ** exponent
+            self.cumulative.append(total)
+
+    def __call__(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+def conll_row(sentence_id, token_id, word, lemma, pos_tag, head, label):
+    return "{0}_{1}\t{2}\t_\t{3}\t_\t{4}\t_\t_\t_\t{5}\t_\t{6}\t_\t_\n".format(
+            sentence_id, token_id, word, lemma, pos_tag, head, label)
+
+def synthetic_sentence(rng, entities, events, sentence_id):
+    """
+    Produces the CoNLL rows of a sentence like "A hofft , dass B den C
+    verhindert ." or, in a third of the cases, a simple sentence without
+    an embedded clause.
+    """
+    trigger, _ = TRIGGERS[rng.randrange(len(TRIGGERS))]
+    subject = "Entity{0}".format(entities())
+    embedded_subject = "Entity{0}".format(entities())
+    obj = "Object{0}".format(entities())
+    event = "event{0}".format(events())
+
+    if rng.random() < 1 / 3.0:
+        return [conll_row(sentence_id, 1, subject, subject, "NE", 2, "SB"),
+                conll_row(sentence_id, 2, trigger, trigger, "VVFIN", 0, "--"),
+                conll_row(sentence_id, 3, obj, obj, "NN", 2, "OA"),
+                conll_row(sentence_id, 4, ".", ".", "$.", 0, "--")]
+
+    return [conll_row(sentence_id, 1, subject, subject, "NE", 2, "SB"),
+            conll_row(sentence_id, 2, trigger, trigger, "VVFIN", 0, "--"),
+            conll_row(sentence_id, 3, ",", ",", "$,", 0, "--"),
+            conll_row(sentence_id, 4, "dass", "dass", "KOUS", 8, "CP"),
+            conll_row(sentence_id, 5, embedded_subject, embedded_subject, "NE", 8, "SB"),
+            conll_row(sentence_id, 6, "den", "der", "ART", 7, "NK"),
+            conll_row(sentence_id, 7, obj, obj, "NN", 8, "OA"),
+            conll_row(sentence_id, 8, event, event, "VVFIN", 2, "OC"),
+            conll_row(sentence_id, 9, ".", ".", "$.", 0, "--")]
+
+def generate_synthetic_corpus(directory, sentence_count, split_count = 4, seed = 0,
+        entity_types = 100000, event_types = 5000, duplicate_rate = 0.0, boilerplate_count = 2000):
+    """
+    Writes a gzipped CoNLL corpus split into several files in the format of
+    the parsed sdewac splits, together with a matching trigger file.
+    With duplicate_rate > 0 that share of the sentences is drawn (Zipf
+    distributed) from a fixed set of boilerplate sentences, as in web
+    crawls. Returns the path of the trigger file.
+    """
+    rng = random.Random(seed)
+    entities = ZipfSampler(rng, entity_types)
+    events = ZipfSampler(rng, event_types)
+    boilerplate = [synthetic_sentence(rng, entities, events, 0) for _ in range(boilerplate_count)]
+    boilerplate_sampler = ZipfSampler(rng, boilerplate_count)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    sentences_per_split = int(sentence_count / split_count)
+    for split in range(split_count):
+        with gzip.open(os.path.join(directory, "split{0:03d}.gz".format(split)), "wb") as f:
+            for sentence_id in range(sentences_per_split):
+                if rng.random() < duplicate_rate:
+                    prefix = "{0}_".format(sentence_id + 1)
+                    f.writelines(prefix + row.split("_", 1)[1] for row in boilerplate[boilerplate_sampler()])
+                else:
+                    f.writelines(synthetic_sentence(rng, entities, events, sentence_id + 1))
+                f.write("\n")
+
+    trigger_path = directory.rstrip(os.sep) + ".triggers"
+    with open(trigger_path, "w") as f:
+        for trigger, polarity in TRIGGERS:
+            f.write("{0} {1}\n".format(trigger, polarity))
+    return trigger_path
+
+def approximate_counter_size(counter):
+    """
+    Estimates the bytes held by a Counter or SpaceSavingCounter, including
+    its keys but not strings shared with other structures.
+    """
+    size = 0
+    if isinstance(counter, SpaceSavingCounter):
+        size += sys.getsizeof(counter.errors) + sys.getsizeof(counter._heap)
+        size += sum(sys.getsizeof(entry) for entry in counter._heap)
+        counts = counter.counts
+    else:
+        counts = counter
+    size += sys.getsizeof(counts)
+    size += sum(sys.getsizeof(key) for key in counts)
+    return size
+
+def collect_entities(corpus_dir, trigger_path, entity_collector):
+    dependency.process_sdewac_splits(
+            corpus_dir,
+            extract_tuples.PipelineProcessor(
+                extract_tuples.SentenceAnalyser(extract_tuples.get_trigger_predicate(trigger_path)),
+                extract_tuples.SentenceFilter([extract_tuples.has_trigger_pred]),
+                entity_collector))
+
+def benchmark_entities(args):
+    trigger_path = generate_synthetic_corpus(args.corpus_dir, args.sentences, seed = args.seed)
+
+    exact = extract_tuples.EntityCollector()
+    start = time.time()
+    collect_entities(args.corpus_dir, trigger_path, exact)
+    exact_time = time.time() - start
+
+    sketch = extract_tuples.EntityCollector(functools.partial(SpaceSavingCounter, args.capacity))
+    start = time.time()
+    collect_entities(args.corpus_dir, trigger_path, sketch)
+    sketch_time = time.time() - start
+
+    print "Exact counters: {0:.2f}s, sketch counters (capacity {1}): {2:.2f}s".format(exact_time, args.capacity, sketch_time)
+    for name in ["subj_position_entities_counter", "obj_position_entities_counter",
+            "relation_counter", "entity_relation_counter"]:
+        exact_counter = getattr(exact, name)
+        sketch_counter = getattr(sketch, name)
+        exact_top = exact_counter.most_common(args.top)
+        sketch_top = set(item for item, _ in sketch_counter.most_common(args.top))
+        recall = sum(1 for item, _ in exact_top if item in sketch_top) / float(max(len(exact_top), 1))
+        max_error = max([abs(sketch_counter[item] - count) for item, count in exact_top] or [0])
+        print "{0}: {1} -> {2} entries, {3} -> {4} bytes, top-{5} recall {6:.2f}, max error {7} (bound {8})".format(
+                name, len(exact_counter), len(sketch_counter),
+                approximate_counter_size(exact_counter), approximate_counter_size(sketch_counter),
+                args.top, recall, max_error, sketch_counter.max_error)
+
+def load_parses(corpus_dir, limit):
+    parses = []
+    for file_ in sorted(os.listdir(corpus_dir)):
+        with gzip.open(os.path.join(corpus_dir, file_), "rb") as f:
+            while len(parses) < limit:
+                parse = dependency.decode_conll_parse(f)
+                if parse is None:
+                    break
+                parses.append(parse)
+    return parses
+
+def extraction_components(trigger_path, output_dir):
+    return [extract_tuples.SentenceCounter(),
+            extract_tuples.SentenceAnalyser(extract_tuples.get_trigger_predicate(trigger_path)),
+            extract_tuples.SentenceFilter([extract_tuples.has_trigger_pred, extract_tuples.has_embedding_depth_between(1, 1)]),
+            extract_tuples.SentenceCounter(),
+            extract_tuples.SentenceWriter(os.path.join(output_dir, "candidates.lmtp")),
+            extract_tuples.SentencePolarityWriter(os.path.join(output_dir, "events.txt"))]
+
+def time_per_sentence(parses, processor):
+    start = time.time()
+    for parse in parses:
+        processor(parse)
+    return (time.time() - start) / len(parses) * 1e6
+
+def time_batched(parses, processor, batch_size):
+    start = time.time()
+    for idx in range(0, len(parses), batch_size):
+        processor(parses[idx:idx + batch_size])
+    return (time.time() - start) / len(parses) * 1e6
+
+def benchmark_pipeline(args):
+    trigger_path = generate_synthetic_corpus(args.corpus_dir, args.sentences, seed = args.seed)
+    parses = load_parses(args.corpus_dir, args.sentences)
+    output_dir = tempfile.mkdtemp()
+
+    dispatch_single = time_per_sentence(parses,
+            extract_tuples.PipelineProcessor(*[extract_tuples.SentenceCounter() for _ in range(6)]))
+    dispatch_batch = time_batched(parses,
+            extract_tuples.BatchPipelineProcessor(*[extract_tuples.SentenceCounter() for _ in range(6)]),
+            args.batch_size)
+    full_single = time_per_sentence(parses,
+            extract_tuples.PipelineProcessor(*extraction_components(trigger_path, output_dir)))
+    full_batch = time_batched(parses,
+            extract_tuples.BatchPipelineProcessor(*extraction_components(trigger_path, output_dir)),
+            args.batch_size)
+
+    print "Overhead per sentence over {0} decoded sentences (batch size {1}):".format(len(parses), args.batch_size)
+    print "  dispatch only (6 counters): {0:.2f}us per-sentence, {1:.2f}us batched".format(dispatch_single, dispatch_batch)
+    print "  extraction pipeline: {0:.2f}us per-sentence, {1:.2f}us batched".format(full_single, full_batch)
+
+def benchmark_decoding(args):
+    generate_synthetic_corpus(args.corpus_dir, args.sentences, seed = args.seed)
+    start = time.time()
+    parses = load_parses(args.corpus_dir, args.sentences)
+    elapsed = time.time() - start
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    print "Decoded and kept {0} sentences: {1:.0f} sentences/s, peak memory {2:.1f}MB, {3} strings in the vocabulary".format(
+            len(parses), len(parses) / elapsed, peak_memory, len(dependency.VOCABULARY))
+
+def ranked_polarities(events_file):
+    events = calculate_chi_squared.load_in_events(events_file)
+    return events, calculate_chi_squared.calculate_chi_squared(events)
+
+def benchmark_dedup(args):
+    trigger_path = generate_synthetic_corpus(args.corpus_dir, args.sentences, seed = args.seed,
+            duplicate_rate = args.duplicate_rate)
+    output_dir = tempfile.mkdtemp()
+
+    timings = {}
+    for name in ["plain", "dedup"]:
+        run_dir = os.path.join(output_dir, name)
+        os.makedirs(run_dir)
+        deduplicator = None
+        if name == "dedup":
+            deduplicator = dedup.DuplicateFilter(dedup.BloomFilter(args.sentences, args.error_rate))
+        start = time.time()
+        dependency.process_sdewac_splits(args.corpus_dir,
+                extract_tuples.PipelineProcessor(*extraction_components(trigger_path, run_dir), deduplicator = deduplicator))
+        timings[name] = time.time() - start
+
+    print "Duplicate rate {0:.0%}: {1:.2f}s without dedup, {2:.2f}s with dedup ({3:.0f} vs {4:.0f} sentences/s)".format(
+            args.duplicate_rate, timings["plain"], timings["dedup"],
+            args.sentences / timings["plain"], args.sentences / timings["dedup"])
+    print "Skipped {0}, filter size {1}KB".format(deduplicator, deduplicator.bloom_filter.memory_size / 1024)
+
+    plain_events, plain_results = ranked_polarities(os.path.join(output_dir, "plain", "events.txt"))
+    dedup_events, dedup_results = ranked_polarities(os.path.join(output_dir, "dedup", "events.txt"))
+    print "Event observations: {0} -> {1}, ranked events: {2} -> {3}".format(
+            sum(e.total for e in plain_events.values()), sum(e.total for e in dedup_events.values()),
+            len(plain_results), len(dedup_results))
+    common = set(plain_results) & set(dedup_results)
+    flipped = sum(1 for key in common if plain_results[key][0] != dedup_results[key][0])
+    top_plain = [key for key, _ in sorted(plain_results.items(), key = lambda r: r[1], reverse = True)[:args.top]]
+    top_dedup = set(key for key, _ in sorted(dedup_results.items(), key = lambda r: r[1], reverse = True)[:args.top])
+    print "Polarity changed for {0} of {1} events ranked in both runs, top-{2} overlap {3}".format(
+            flipped, len(common), args.top, sum(1 for key in top_plain if key in top_dedup))
+
+# The event writer needs an embedded clause, so every configuration requires one
+FAN_OUT_FILTERS = [
+        ["has_trigger_pred", "is_complex_sentence"],
+        ["has_trigger_pred", ["has_embedding_depth_between", 1, 1]],
+        ["has_trigger_pred", "is_complex_sentence", "has_named_entity_subject"],
+        ["has_trigger_pred", "is_complex_sentence", "has_no_unresolved_pronouns"],
+        ["has_trigger_pred", "is_complex_sentence", "is_not_reflexive"],
+        ["has_trigger_pred", "is_complex_sentence", "has_unmodified_predicate"],
+        ["is_complex_sentence", "has_trigger_pred"],
+        ["is_complex_sentence", "has_named_entity_subject", "has_no_unresolved_pronouns"]]
+
+def benchmark_fan_out(args):
+    trigger_path = generate_synthetic_corpus(args.corpus_dir, args.sentences, seed = args.seed)
+    output_dir = tempfile.mkdtemp()
+    config = {"branches": [{"name": "config{0}".format(idx), "triggers": trigger_path, "filters": filters,
+        "candidates": os.path.join(output_dir, "{mode}", "candidates_{name}.lmtp"),
+        "events": os.path.join(output_dir, "{mode}", "events_{name}.txt")}
+        for idx, filters in enumerate(FAN_OUT_FILTERS[:args.configurations])]}
+
+    def branches_for(mode):
+        os.makedirs(os.path.join(output_dir, mode))
+        for branch_config in config["branches"]:
+            for output in ["candidates", "events"]:
+                branch_config[output] = branch_config[output].replace("{mode}", mode)
+        branches = fan_out.create_branches(config)
+        for branch_config in config["branches"]:
+            for output in ["candidates", "events"]:
+                branch_config[output] = branch_config[output].replace(mode, "{mode}")
+        return branches
+
+    start = time.time()
+    for branch in branches_for("separate"):
+        dependency.process_sdewac_splits(args.corpus_dir, extract_tuples.PipelineProcessor(*branch.components))
+    separate_time = time.time() - start
+
+    start = time.time()
+    dependency.process_sdewac_splits(args.corpus_dir,
+            extract_tuples.FanOutProcessor([], [branch.components for branch in branches_for("fan_out")]))
+    fan_out_time = time.time() - start
+
+    identical = all(open(os.path.join(output_dir, "separate", file_)).read() == open(os.path.join(output_dir, "fan_out", file_)).read()
+            for file_ in os.listdir(os.path.join(output_dir, "separate")))
+    print "{0} configurations: {1:.2f}s in separate runs, {2:.2f}s in one fan-out pass ({3:.1f}x), outputs identical: {4}".format(
+            len(config["branches"]), separate_time, fan_out_time, separate_time / fan_out_time, identical)
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, file_)) for root, _, files in os.walk(path) for file_ in files)
+
+def read_text_outputs(output_dir):
+    events = calculate_chi_squared.load_in_events(os.path.join(output_dir, "events.txt"))
+    token_count = 0
+    with open(os.path.join(output_dir, "candidates.lmtp")) as f:
+        for line in f:
+            row = line.split("\t")
+            if len(row) > 1:
+                token_count += 1
+    return events, token_count
+
+def read_columnar_outputs(output_dir):
+    events = calculate_chi_squared.load_in_columnar_events(output_dir)
+    tokens = columnar.ColumnStoreReader(output_dir).table("tokens")
+    token_count = 0
+    for chunk in tokens.chunks():
+        token_count += len(chunk["token"])
+        # Touch every column, as a consumer would
+        for values in chunk.values():
+            values.sum()
+    return events, token_count
+
+def benchmark_columnar(args):
+    trigger_path = generate_synthetic_corpus(args.corpus_dir, args.sentences, seed = args.seed)
+    parses = load_parses(args.corpus_dir, args.sentences)
+    output_dir = tempfile.mkdtemp()
+
+    contexts = [extract_tuples.SentenceContext(parse) for parse in parses]
+    _, contexts = extract_tuples.SentenceAnalyser(extract_tuples.get_trigger_predicate(trigger_path)).process_batch(contexts)
+    _, contexts = extract_tuples.SentenceFilter([extract_tuples.has_trigger_pred,
+        extract_tuples.has_embedding_depth_between(1, 1)]).process_batch(contexts)
+
+    formats = [("text", None), ("columnar", False), ("columnar compressed", True)]
+    results = {}
+    for name, compressed in formats:
+        run_dir = os.path.join(output_dir, name.replace(" ", "_"))
+        start = time.time()
+        if compressed is None:
+            os.makedirs(run_dir)
+            extract_tuples.SentenceWriter(os.path.join(run_dir, "candidates.lmtp")).process_batch(contexts)
+            extract_tuples.SentencePolarityWriter(os.path.join(run_dir, "events.txt")).process_batch(contexts)
+        else:
+            writer = extract_tuples.ColumnarWriter(run_dir, compressed = compressed)
+            writer.process_batch(contexts)
+            writer.close()
+        write_time = time.time() - start
+
+        start = time.time()
+        if compressed is None:
+            events, token_count = read_text_outputs(run_dir)
+        else:
+            events, token_count = read_columnar_outputs(run_dir)
+        read_time = time.time() - start
+        results[name] = events
+        print "{0}: write {1:.2f}s ({2:.0f} candidates/s), read {3:.2f}s ({4} tokens, {5} events), {6:.1f}MB".format(
+                name, write_time, len(contexts) / write_time, read_time, token_count, len(events),
+                directory_size(run_dir) / 1024.0 / 1024.0)
+
+    identical = all(dict((key, (event.positive_count, event.negative_count, event.polarity_source))
+        for key, event in results[name].items()) == dict((key, (event.positive_count, event.negative_count, event.polarity_source))
+        for key, event in results["text"].items()) for name, _ in formats)
+    print "Event statistics identical: {0}".format(identical)
+
+def corrupt_sentence(rng, sentence):
+    lines = sentence.splitlines(True)
+    kind = rng.randrange(4)
+    if kind == 0:
+        lines[0] = lines[0].replace("\t", "\t" + "x" * (dependency.MAX_LINE_BYTES + 1), 1)
+    elif kind == 1:
+        lines = lines * (dependency.MAX_TOKENS_PER_SENTENCE // len(lines) + 1)
+    elif kind == 2:
+        lines[0] = lines[0].replace("\t", "\t\t", 1)
+    else:
+        lines.insert(0, "garbage\n")
+    return "".join(lines)
+
+def write_corrupted_corpus(corpus_dir, dirty_dir, corrupt_rate, seed):
+    """
+    Copies the corpus, corrupting a fraction of the sentences, removing the
+    sentence boundaries of a stretch in the middle of every split and
+    truncating the last split.
+    """
+    rng = random.Random(seed)
+    if not os.path.isdir(dirty_dir):
+        os.makedirs(dirty_dir)
+    files = sorted(os.listdir(corpus_dir))
+    for file_ in files:
+        with gzip.open(os.path.join(corpus_dir, file_), "rb") as f:
+            sentences = list(sampling.iter_sentence_texts(f))
+        middle = len(sentences) // 2
+        sentences[middle:middle + 100] = ["".join(sentences[middle:middle + 100])]
+        with gzip.open(os.path.join(dirty_dir, file_), "wb") as f:
+            for sentence in sentences:
+                if rng.random() < corrupt_rate:
+                    sentence = corrupt_sentence(rng, sentence)
+                f.write(sentence + "\n")
+    last_path = os.path.join(dirty_dir, files[-1])
+    with open(last_path, "r+b") as f:
+        f.truncate(os.path.getsize(last_path) * 3 // 4)
+
+def benchmark_dirty(args):
+    trigger_path = generate_synthetic_corpus(args.corpus_dir, args.sentences, seed = args.seed)
+    dirty_dir = args.corpus_dir.rstrip(os.sep) + "_dirty"
+    write_corrupted_corpus(args.corpus_dir, dirty_dir, args.corrupt_rate, args.seed)
+    output_dir = tempfile.mkdtemp()
+
+    for name, corpus_dir in [("clean", args.corpus_dir), ("dirty", dirty_dir)]:
+        run_dir = os.path.join(output_dir, name)
+        os.makedirs(run_dir)
+        errors = dependency.ErrorReport(os.path.join(run_dir, "quarantine.tsv"))
+        components = extraction_components(trigger_path, run_dir)
+        start = time.time()
+        dependency.process_sdewac_splits(corpus_dir, extract_tuples.PipelineProcessor(*components, errors = errors))
+        elapsed = time.time() - start
+        errors.close()
+        print "{0}: {1} sentences in {2:.2f}s ({3:.0f} sentences/s), {4} candidates, rejected {5}".format(
+                name, components[0].count, elapsed, components[0].count / elapsed, components[3].count, errors)
+    print "Peak memory {0:.1f}MB, quarantine file {1}KB".format(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            os.path.getsize(os.path.join(output_dir, "dirty", "quarantine.tsv")) / 1024)
+
+def benchmark_progress(args):
+    trigger_path = generate_synthetic_corpus(args.corpus_dir, args.sentences, seed = args.seed)
+    split_paths = [os.path.join(args.corpus_dir, file_) for file_ in sorted(os.listdir(args.corpus_dir))]
+    output_dir = tempfile.mkdtemp()
+    devnull = open(os.devnull, "w")
+
+    timings = {}
+    for mode in ["none", "counter", "tracker"]:
+        run_dir = os.path.join(output_dir, mode)
+        os.makedirs(run_dir)
+        components = extraction_components(trigger_path, run_dir)
+        tracker = None
+        if mode == "counter":
+            # The former indicator, as used with the UI
+            components.insert(1, extract_tuples.CountIndicator(components[0], "Processing sentence #", True, 1))
+        elif mode == "tracker":
+            tracker = progress.ProgressTracker(split_paths, components[0], args.interval,
+                    os.path.join(run_dir, "status.json"), output = devnull).start()
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            start = time.time()
+            dependency.process_sdewac_splits(args.corpus_dir, extract_tuples.PipelineProcessor(*components), progress = tracker)
+            timings[mode] = time.time() - start
+        finally:
+            sys.stdout = stdout
+        if tracker is not None:
+            tracker.stop()
+
+    count = components[0].count
+    print "{0} sentences; progress reports every {1}s:".format(count, args.interval)
+    for mode, description in [("none", "no progress"), ("counter", "count per sentence"), ("tracker", "progress tracker")]:
+        print "  {0}: {1:.0f} sentences/s, {2:+.2f}us per sentence".format(
+                description, count / timings[mode], (timings[mode] - timings["none"]) / count * 1e6)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks on a synthetic corpus")
+    parser.add_argument("--corpus-dir", default = "synthetic_corpus")
+    parser.add_argument("--sentences", default = 100000, type = int)
+    parser.add_argument("--seed", default = 0, type = int)
+    subparsers = parser.add_subparsers()
+
+    entities_parser = subparsers.add_parser("entities",
+            help = "Compare exact and bounded-memory entity counting")
+    entities_parser.add_argument("--capacity", default = 1000, type = int)
+    entities_parser.add_argument("--top", default = 25, type = int)
+    entities_parser.set_defaults(run = benchmark_entities)
+
+    pipeline_parser = subparsers.add_parser("pipeline",
+            help = "Compare per-sentence and batch pipeline overhead")
+    pipeline_parser.add_argument("--batch-size", default = 2000, type = int)
+    pipeline_parser.set_defaults(run = benchmark_pipeline)
+
+    decoding_parser = subparsers.add_parser("decoding",
+            help = "Measure decoding throughput and peak memory when keeping all parses")
+    decoding_parser.set_defaults(run = benchmark_decoding)
+
+    dedup_parser = subparsers.add_parser("dedup",
+            help = "Measure duplicate suppression on a corpus with boilerplate sentences")
+    dedup_parser.add_argument("--duplicate-rate", default = 0.3, type = float)
+    dedup_parser.add_argument("--error-rate", default = 0.001, type = float)
+    dedup_parser.add_argument("--top", default = 50, type = int)
+    dedup_parser.set_defaults(run = benchmark_dedup)
+
+    fan_out_parser = subparsers.add_parser("fan-out",
+            help = "Compare separate runs of several configurations to a single fan-out pass")
+    fan_out_parser.add_argument("--configurations", default = 8, type = int)
+    fan_out_parser.set_defaults(run = benchmark_fan_out)
+
+    columnar_parser = subparsers.add_parser("columnar",
+            help = "Compare writing and reading the text outputs and the column tables")
+    columnar_parser.set_defaults(run = benchmark_columnar)
+
+    dirty_parser = subparsers.add_parser("dirty",
+            help = "Compare throughput on a clean corpus and on a corrupted copy")
+    dirty_parser.add_argument("--corrupt-rate", default = 0.05, type = float)
+    dirty_parser.set_defaults(run = benchmark_dirty)
+
+    progress_parser = subparsers.add_parser("progress",
+            help = "Measure the overhead of progress reporting")
+    progress_parser.add_argument("--interval", default = 1.0, type = float)
+    progress_parser.set_defaults(run = benchmark_progress)
+
+    args = parser.parse_args()
+    args.run(args)
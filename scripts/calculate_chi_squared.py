@@ -3,6 +3,9 @@ from scipy.stats import chisquare
 import numpy as np
 
 import math
+import multiprocessing
+
+import columnar
 
 # This class captures each 'Event' where an 'Event' is 'something that
 # happens to someone or something'. In our case, this starts off a just a
@@ -55,15 +58,15 @@ class EventStatistic:
 def calculate_events_pmi(event, total_p_pos, total_p_neg):
     total = event.positive_count + event.negative_count
 
-    #p(+ | ev)
+    #p(+ | ev)
     p_pos = event.positive_count / float(total)
-    #p(- | ev)
+    #p(- | ev)
     p_neg = event.negative_count / float(total)
 
     if p_pos == 0:
         pmi_pos = float('-inf')
     else:
-        #log(p(+ | ev) / p(+))
+        #log(p(+ | ev) / p(+))
         pmi_pos = math.log(p_pos/total_p_pos)
 
     if p_neg == 0:
@@ -101,6 +104,129 @@ def get_total_pos_neg_probability_in_events(events):
         neg_count += event.negative_count
     return pos_count / float(pos_count + neg_count), neg_count / float(pos_count + neg_count)
 
+def calculate_pmi_arrays(positive_counts, negative_counts):
+    """
+    Vectorised version of calculate_events_pmi. Takes arrays of shape
+    (replicates, events) and returns a boolean array that is True where the
+    positive polarity dominates, together with the positive and negative
+    PMI. Events that were not observed in a replicate get a PMI of nan.
+    """
+    positive_counts = positive_counts.astype(np.float64)
+    negative_counts = negative_counts.astype(np.float64)
+    totals = positive_counts + negative_counts
+    all_totals = totals.sum(axis = 1)[:, np.newaxis]
+    total_p_pos = positive_counts.sum(axis = 1)[:, np.newaxis] / all_totals
+    total_p_neg = negative_counts.sum(axis = 1)[:, np.newaxis] / all_totals
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        pmi_pos = np.log(positive_counts / totals / total_p_pos)
+        pmi_neg = np.log(negative_counts / totals / total_p_neg)
+        is_positive = pmi_pos > pmi_neg
+
+    return is_positive, pmi_pos, pmi_neg
+
+def ranking_keys(is_positive, pmi):
+    """
+    Sort keys that reproduce the order of the printed ranking, which sorts
+    the (polarity, pmi) tuples in reverse, i.e. all "-" events before the
+    "+" events, each by decreasing PMI.
+    """
+    pmi = np.where(np.isnan(pmi), -np.inf, pmi)
+    return np.where(is_positive, 0.0, 1e6) + pmi
+
+def _bootstrap_chunk(args):
+    positive_counts, negative_counts, selected, point_is_positive, point_ranks, \
+            method, seed, replicates, rank_tolerance = args
+    random_state = np.random.RandomState(seed)
+    event_count = len(positive_counts)
+
+    if method == "multinomial":
+        all_counts = np.concatenate([positive_counts, negative_counts])
+        samples = random_state.multinomial(all_counts.sum(), all_counts / float(all_counts.sum()), size = replicates)
+        positive_samples = samples[:, :event_count]
+        negative_samples = samples[:, event_count:]
+    else:
+        positive_samples = random_state.poisson(positive_counts, size = (replicates, event_count))
+        negative_samples = random_state.poisson(negative_counts, size = (replicates, event_count))
+
+    # The marginal polarity probabilities depend on all events
+    is_positive, pmi_pos, pmi_neg = calculate_pmi_arrays(positive_samples, negative_samples)
+    is_positive = is_positive[:, selected]
+    pmi_pos = pmi_pos[:, selected]
+    pmi_neg = pmi_neg[:, selected]
+
+    # PMI of the polarity found on the full data, for the confidence intervals
+    point_direction_pmi = np.where(point_is_positive, pmi_pos, pmi_neg)
+
+    keys = ranking_keys(is_positive, np.where(is_positive, pmi_pos, pmi_neg))
+    ranks = np.argsort(np.argsort(-keys, axis = 1), axis = 1)
+
+    return (point_direction_pmi.astype(np.float32),
+            (is_positive == point_is_positive).sum(axis = 0),
+            (np.abs(ranks - point_ranks) <= rank_tolerance).sum(axis = 0))
+
+class BootstrapResult:
+    def __init__(self, pmi_low, pmi_high, polarity_agreement, rank_stability):
+        self.pmi_low = pmi_low
+        self.pmi_high = pmi_high
+        self.polarity_agreement = polarity_agreement
+        self.rank_stability = rank_stability
+
+def bootstrap_events_pmi(events, replicates, confidence = 0.95, method = "poisson",
+        workers = None, seed = 0, chunk_size = 250, rank_tolerance = 10):
+    """
+    Resamples the (trigger, polarity, event) observations and recomputes the
+    PMI of every event for each replicate. All events are resampled, but only
+    those that pass the cutoff of calculate_chi_squared are reported.
+
+    Resampling draws whole count arrays at once, either with independent
+    Poisson draws per count (the Poisson bootstrap) or with a multinomial
+    draw that keeps the number of observations fixed. Chunks of replicates
+    are processed in parallel.
+
+    Returns a dictionary from event to a BootstrapResult holding the
+    percentile confidence interval of the event's PMI for its polarity,
+    the fraction of replicates in which that polarity still dominates and
+    the fraction of replicates in which the event stays within
+    rank_tolerance places of its rank in the printed ranking.
+    """
+    keys = sorted(events.keys())
+    positive_counts = np.array([events[key].positive_count for key in keys], dtype = np.float64)
+    negative_counts = np.array([events[key].negative_count for key in keys], dtype = np.float64)
+    selected = np.array([idx for idx, key in enumerate(keys) if events[key].total >= 5], dtype = np.int64)
+
+    is_positive, pmi_pos, pmi_neg = calculate_pmi_arrays(positive_counts[np.newaxis, :], negative_counts[np.newaxis, :])
+    point_is_positive = is_positive[0, selected]
+    point_keys = ranking_keys(point_is_positive, np.where(is_positive, pmi_pos, pmi_neg)[0, selected])
+    point_ranks = np.argsort(np.argsort(-point_keys))
+
+    tasks = []
+    for chunk_idx, start in enumerate(range(0, replicates, chunk_size)):
+        tasks.append((positive_counts, negative_counts, selected, point_is_positive, point_ranks,
+            method, seed + chunk_idx, min(chunk_size, replicates - start), rank_tolerance))
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        chunk_results = pool.map(_bootstrap_chunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    pmi_samples = np.concatenate([chunk[0] for chunk in chunk_results])
+    polarity_agreement = sum(chunk[1] for chunk in chunk_results) / float(replicates)
+    rank_stability = sum(chunk[2] for chunk in chunk_results) / float(replicates)
+
+    alpha = (1.0 - confidence) / 2.0
+    # Replicates in which an event was not observed have no PMI at all
+    pmi_low = np.nanpercentile(pmi_samples, 100 * alpha, axis = 0)
+    pmi_high = np.nanpercentile(pmi_samples, 100 * (1.0 - alpha), axis = 0)
+
+    results = {}
+    for position, idx in enumerate(selected):
+        results[keys[idx]] = BootstrapResult(pmi_low[position], pmi_high[position],
+                polarity_agreement[position], rank_stability[position])
+    return results
+
 def load_in_events(event_file):
     events = {}
 
@@ -119,17 +245,74 @@ def load_in_events(event_file):
 
     return events
 
+def load_in_columnar_events(directory):
+    """
+    Like load_in_events, for the column store written by
+    extract_tuples.ColumnarWriter. The counts are computed on the event
+    columns without going through the individual observations.
+    """
+    store = columnar.ColumnStoreReader(directory)
+    table = store.table("events")
+    event_ids = table.column("event")
+    is_positive = table.column("polarity") > 0
+    positive_counts = np.bincount(event_ids[is_positive], minlength = len(store.vocabulary))
+    negative_counts = np.bincount(event_ids[~is_positive], minlength = len(store.vocabulary))
+
+    # As in the text format, the trigger of the first observation is kept
+    observed_ids, first_positions = np.unique(event_ids, return_index = True)
+    triggers = table.column("trigger")[first_positions]
+
+    events = {}
+    strings = store.vocabulary.strings
+    for event_id, trigger_id in zip(observed_ids.tolist(), triggers.tolist()):
+        event = EventStatistic(strings[event_id], strings[trigger_id], "TODO", "TODO")
+        event.positive_count = int(positive_counts[event_id])
+        event.negative_count = int(negative_counts[event_id])
+        events[event.event] = event
+    return events
+
+def ranking_lines(events, sorted_results, bootstrap_results = None):
+    """
+    The output lines for the ranked results, as read by scoring_service.py.
+    """
+    for key, chi in sorted_results:
+        event = events[key]
+        line = "{0} {1} {2} [{3}, {4}]".format(key, chi[0], chi[1], event.positive_count, event.negative_count)
+        if bootstrap_results is not None:
+            bootstrap = bootstrap_results[key]
+            line += " [{0:.4f}, {1:.4f}] {2:.3f} {3:.3f}".format(bootstrap.pmi_low, bootstrap.pmi_high,
+                    bootstrap.polarity_agreement, bootstrap.rank_stability)
+        yield line
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="")
-    parser.add_argument("input_file")
+    parser.add_argument("input_file",
+            help = "Events file written by extract_tuples.py, or a directory written with --columnar-dir")
+    parser.add_argument("--bootstrap", default = 0, type = int,
+            help = "Number of bootstrap replicates used for confidence intervals (0 disables)")
+    parser.add_argument("--confidence", default = 0.95, type = float)
+    parser.add_argument("--resampling", default = "poisson", choices = ["poisson", "multinomial"])
+    parser.add_argument("--workers", default = None, type = int,
+            help = "Number of processes for the bootstrap (defaults to the number of cores)")
+    parser.add_argument("--seed", default = 0, type = int)
+    parser.add_argument("--rank-tolerance", default = 10, type = int,
+            help = "Rank shift up to which an event counts as stable")
     args = parser.parse_args()
 
-    events = load_in_events(args.input_file)
+    if columnar.is_column_store(args.input_file):
+        events = load_in_columnar_events(args.input_file)
+    else:
+        events = load_in_events(args.input_file)
 
     results = calculate_chi_squared(events)
 
     sorted_results = sorted(results.items(), key=lambda r: r[1], reverse = True)
 
-    for key, chi in sorted_results:
-        event = events[key]
-        print "{0} {1} {2} [{3}, {4}]".format(key, chi[0], chi[1], event.positive_count, event.negative_count)
+    bootstrap_results = None
+    if args.bootstrap > 0:
+        bootstrap_results = bootstrap_events_pmi(events, args.bootstrap, confidence = args.confidence,
+                method = args.resampling, workers = args.workers, seed = args.seed,
+                rank_tolerance = args.rank_tolerance)
+
+    for line in ranking_lines(events, sorted_results, bootstrap_results):
+        print line
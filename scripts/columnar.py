@@ -0,0 +1,164 @@
+# Columnar storage of extraction outputs. A store is a directory with one
+# subdirectory per table, holding one file per column and chunk (e.g.
+# events/event.00003.npy), and the vocabulary that maps the ids in string
+# columns back to strings.
+#
+# Chunks are .npy files that can be memory-mapped, or compressed .npz files
+# that are smaller but have to be read into memory.
+
+import json
+import os
+
+import numpy as np
+
+import vocabulary
+
+CHUNK_SIZE = 1 << 16
+VOCABULARY_FILE = "vocabulary.txt"
+SCHEMA_FILE = "schema.json"
+
+def chunk_path(table_directory, column, chunk, compressed):
+    return os.path.join(table_directory, "{0}.{1:05d}.{2}".format(column, chunk, "npz" if compressed else "npy"))
+
+class TableWriter:
+    """
+    Collects rows of a table and writes them out in chunks of chunk_size
+    rows. Columns are given as a list of (name, numpy dtype) pairs.
+    """
+    def __init__(self, store, name, columns):
+        self.store = store
+        self.directory = os.path.join(store.directory, name)
+        self.columns = [(column, np.dtype(dtype)) for column, dtype in columns]
+        self.values = [[] for _ in columns]
+        self.chunk_count = 0
+        self.row_count = 0
+
+        if os.path.exists(os.path.join(self.directory, SCHEMA_FILE)):
+            raise ValueError("{0} already contains a table".format(self.directory))
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(os.path.join(self.directory, SCHEMA_FILE), "w") as f:
+            json.dump({"columns": [(column, dtype.str) for column, dtype in self.columns],
+                "compressed": store.compressed}, f)
+
+    def append(self, *row):
+        for values, value in zip(self.values, row):
+            values.append(value)
+        if len(self.values[0]) >= self.store.chunk_size:
+            self.flush()
+
+    def extend(self, *columns):
+        """
+        Appends several rows given column by column.
+        """
+        for values, column_values in zip(self.values, columns):
+            values.extend(column_values)
+        if len(self.values[0]) >= self.store.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.values[0]) == 0:
+            return
+        # Strings referenced by the chunk are saved before the chunk itself
+        self.store.save_vocabulary()
+        for (column, dtype), values in zip(self.columns, self.values):
+            array = np.array(values, dtype = dtype)
+            path = chunk_path(self.directory, column, self.chunk_count, self.store.compressed)
+            if self.store.compressed:
+                np.savez_compressed(path, values = array)
+            else:
+                np.save(path, array)
+        self.row_count += len(self.values[0])
+        self.chunk_count += 1
+        self.values = [[] for _ in self.columns]
+
+class ColumnStoreWriter:
+    """
+    Writes tables whose string columns hold ids of the shared VOCABULARY.
+    The new part of the vocabulary is appended to the store before each
+    chunk, so a store is consistent even if writing is interrupted.
+    """
+    def __init__(self, directory, chunk_size = CHUNK_SIZE, compressed = False):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.compressed = compressed
+        self.tables = []
+        self.saved_strings = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(os.path.join(directory, VOCABULARY_FILE)):
+            raise ValueError("{0} already contains a column store".format(directory))
+
+    def create_table(self, name, columns):
+        table = TableWriter(self, name, columns)
+        self.tables.append(table)
+        return table
+
+    def save_vocabulary(self):
+        strings = vocabulary.VOCABULARY.strings
+        if self.saved_strings == len(strings):
+            return
+        with open(os.path.join(self.directory, VOCABULARY_FILE), "a") as f:
+            for string in strings[self.saved_strings:]:
+                f.write(string)
+                f.write("\n")
+        self.saved_strings = len(strings)
+
+    def close(self):
+        for table in self.tables:
+            table.flush()
+        self.save_vocabulary()
+
+class TableReader:
+    def __init__(self, directory, mmap = True):
+        self.directory = directory
+        self.mmap = mmap
+        with open(os.path.join(directory, SCHEMA_FILE)) as f:
+            schema = json.load(f)
+        self.columns = [column for column, _ in schema["columns"]]
+        self.dtypes = dict((column, np.dtype(str(dtype))) for column, dtype in schema["columns"])
+        self.compressed = schema["compressed"]
+        self.chunk_count = 0
+        while os.path.exists(chunk_path(directory, self.columns[0], self.chunk_count, self.compressed)):
+            self.chunk_count += 1
+
+    def read_chunk(self, column, chunk):
+        path = chunk_path(self.directory, column, chunk, self.compressed)
+        if self.compressed:
+            with np.load(path) as data:
+                return data["values"]
+        return np.load(path, mmap_mode = "r" if self.mmap else None)
+
+    def chunks(self, columns = None):
+        """
+        Yields a dictionary of arrays per chunk.
+        """
+        for chunk in xrange(self.chunk_count):
+            yield dict((column, self.read_chunk(column, chunk)) for column in columns or self.columns)
+
+    def column(self, name):
+        """
+        The whole column as one array. A single uncompressed chunk is
+        returned memory-mapped, several chunks are concatenated.
+        """
+        arrays = [self.read_chunk(name, chunk) for chunk in xrange(self.chunk_count)]
+        if len(arrays) == 0:
+            return np.zeros(0, dtype = self.dtypes[name])
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.concatenate(arrays)
+
+    def __len__(self):
+        return sum(len(self.read_chunk(self.columns[0], chunk)) for chunk in xrange(self.chunk_count))
+
+class ColumnStoreReader:
+    def __init__(self, directory, mmap = True):
+        self.directory = directory
+        self.mmap = mmap
+        self.vocabulary = vocabulary.Vocabulary.load(os.path.join(directory, VOCABULARY_FILE))
+
+    def table(self, name):
+        return TableReader(os.path.join(self.directory, name), self.mmap)
+
+def is_column_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, VOCABULARY_FILE))
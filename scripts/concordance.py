@@ -0,0 +1,589 @@
+#!/usr/bin/env python2
+# Inverted index over the candidate sentences (candidates*.lmtp) and the
+# sentence lists (e.g. data/output_sentences_ordered.txt), with
+# keyword-in-context queries.
+#
+#   concordance.py index INDEX_DIR candidates0.lmtp candidates1.lmtp ...
+#   concordance.py query INDEX_DIR fuerchten trigger:hoffen
+#
+# Terms are "lemma:...", "word:..." (lower case), "trigger:..." and
+# "event:..."; a term without a kind is a lemma. A query returns the
+# sentences that contain all of its terms. Candidates are indexed by lemma
+# and word; their triggers and events are taken from the events*.txt file
+# written alongside. Sentence lists have no lemmas and are indexed by word
+# and by the trigger at the start of each line.
+#
+# Every indexing run adds segments for the new files and for whatever has
+# been appended to files that were indexed before, so the index can be
+# updated whenever new outputs arrive. Segments of a file that are of
+# similar size are merged once MERGE_FACTOR of them have accumulated, so
+# that a file appended to in many small steps still has few segments.
+
+import argparse
+import heapq
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from array import array
+
+import numpy as np
+
+MANIFEST_FILE = "index.json"
+# Term offset, postings offset, postings length, sentence count
+TERM_ENTRY = struct.Struct("<QQII")
+# Sentences per segment, which bounds the memory used while indexing
+SEGMENT_SENTENCES = 200000
+# Segments with up to this many times as many sentences as each other are
+# merged once there are this many of them; larger segments are left alone
+MERGE_FACTOR = 4
+CHECKSUM_BYTES = 4096
+DEFAULT_KIND = "lemma"
+
+def normalise_word(word, cache = {}):
+    try:
+        return cache[word]
+    except KeyError:
+        normalised = cache[word] = word.decode("utf-8", "replace").lower().encode("utf-8")
+        return normalised
+
+def parse_term(term):
+    kind, separator, value = term.partition(":")
+    if not separator:
+        kind, value = DEFAULT_KIND, term
+    if kind == "word":
+        value = normalise_word(value)
+    return kind, value
+
+def source_format(path):
+    return "conll" if path.endswith(".lmtp") else "text"
+
+def events_path_for(path):
+    """
+    The events file written together with a candidates file, in which line
+    k holds the event of candidate sentence k.
+    """
+    directory, file_ = os.path.split(path)
+    if not file_.startswith("candidates"):
+        return None
+    events_path = os.path.join(directory, "events" + file_[len("candidates"):-len(".lmtp")] + ".txt")
+    return events_path if os.path.exists(events_path) else None
+
+def count_conll_sentences(f):
+    """
+    Number of complete sentences that read_conll_sentences would yield from
+    the current position.
+    """
+    count = 0
+    has_terms = False
+    for line in f:
+        if len(line.strip()) == 0:
+            if has_terms:
+                count += 1
+                has_terms = False
+        elif line.count("\t") >= 3:
+            has_terms = True
+    return count
+
+def count_lines(path):
+    """
+    Number of complete lines of a file.
+    """
+    count = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.endswith("\n"):
+                count += 1
+    return count
+
+def read_conll_sentences(f, events = None):
+    """
+    Yields the offset, the end and the terms of every complete sentence in
+    a candidates file, starting at the current position.
+    """
+    offset = f.tell()
+    terms = set()
+    while True:
+        line = f.readline()
+        if len(line) == 0:
+            return
+        if len(line.strip()) == 0:
+            if terms:
+                if events is not None:
+                    event = next(events, "").split()
+                    if len(event) == 3:
+                        terms.add("trigger:" + event[0])
+                        terms.add("event:" + event[2])
+                yield offset, f.tell(), terms
+                terms = set()
+            offset = f.tell()
+            continue
+        row = line.split("\t")
+        if len(row) > 3:
+            terms.add("lemma:" + row[3])
+            terms.add("word:" + normalise_word(row[1]))
+
+def read_text_sentences(f):
+    offset = f.tell()
+    while True:
+        line = f.readline()
+        if len(line) == 0 or not line.endswith("\n"):
+            return
+        trigger, separator, sentence = line.partition(",")
+        if separator:
+            terms = set("word:" + normalise_word(word) for word in sentence.split())
+            terms.add("trigger:" + trigger.strip())
+            yield offset, f.tell(), terms
+        offset = f.tell()
+
+def file_checksum(path, end):
+    """
+    Checksum of the bytes before end, to recognise a file that has been
+    rewritten instead of appended to.
+    """
+    with open(path, "rb") as f:
+        f.seek(max(end - CHECKSUM_BYTES, 0))
+        return zlib.crc32(f.read(end - f.tell())) & 0xffffffff
+
+def write_segment(path, postings):
+    write_segment_terms(path, ((term, np.frombuffer(postings[term], dtype = np.int64)) for term in sorted(postings)))
+
+def write_segment_terms(path, terms):
+    """
+    Writes a segment from (term, sorted offsets) pairs in the order of the
+    terms.
+    """
+    term_offset = 0
+    postings_offset = 0
+    with open(path + ".terms", "wb") as terms_file, open(path + ".tidx", "wb") as entries_file, \
+            open(path + ".post", "wb") as postings_file:
+        for term, offsets in terms:
+            data = zlib.compress(np.diff(offsets, prepend = 0).astype("<u8").tostring())
+            entries_file.write(TERM_ENTRY.pack(term_offset, postings_offset, len(data), len(offsets)))
+            terms_file.write(term)
+            terms_file.write("\n")
+            postings_file.write(data)
+            term_offset += len(term) + 1
+            postings_offset += len(data)
+
+def merge_segment_terms(segments):
+    """
+    Yields the terms of several segments with their combined, sorted
+    offsets, in the order of the terms.
+    """
+    entries = heapq.merge(*[numbered_terms(segment, order) for order, segment in enumerate(segments)])
+    term, parts = None, []
+    for next_term, order, idx in entries:
+        if next_term != term and parts:
+            yield term, sorted_offsets(parts)
+            parts = []
+        term = next_term
+        parts.append(segments[order].read_postings(segments[order].entry(idx)))
+    if parts:
+        yield term, sorted_offsets(parts)
+
+def sorted_offsets(parts):
+    # A merged segment may cover the regions before and after another one;
+    # merge sort is fast on the sorted runs
+    return np.sort(np.concatenate(parts), kind = "mergesort")
+
+def numbered_terms(segment, order):
+    for idx in xrange(segment.term_count):
+        yield segment.term(idx), order, idx
+
+def segment_sentences(segment):
+    # Indexes written before the counts were recorded are merged as if their
+    # segments had a single sentence
+    return segment.get("sentences", 1)
+
+def segment_tier(sentences):
+    """
+    The order of magnitude of a segment's size in the base MERGE_FACTOR.
+    """
+    tier = 0
+    while sentences >= MERGE_FACTOR:
+        sentences //= MERGE_FACTOR
+        tier += 1
+    return tier
+
+class Segment:
+    """
+    Postings of the sentences in regions of one source file. Terms are
+    found by binary search in the memory-mapped term table, so opening a
+    segment does not read its dictionary. The files are closed once they
+    are mapped, so open segments do not hold file descriptors.
+    """
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.terms, self.entries, self.postings = [map_file(path + suffix) for suffix in [".terms", ".tidx", ".post"]]
+        self.term_count = len(self.entries) // TERM_ENTRY.size
+
+    def entry(self, idx):
+        return TERM_ENTRY.unpack_from(self.entries, idx * TERM_ENTRY.size)
+
+    def term(self, idx):
+        start = self.entry(idx)[0]
+        return self.terms[start:self.terms.find("\n", start)]
+
+    def find_entry(self, term):
+        """
+        Returns the table entry of a term, or None if it does not occur.
+        """
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.term_count or self.term(low) != term:
+            return None
+        return self.entry(low)
+
+    def read_postings(self, entry):
+        """
+        Returns the sorted sentence offsets of a table entry.
+        """
+        _, offset, length, _ = entry
+        deltas = np.frombuffer(zlib.decompress(self.postings[offset:offset + length]), dtype = "<u8")
+        return np.cumsum(deltas).view(np.int64)
+
+    def lookup(self, term):
+        entry = self.find_entry(term)
+        if entry is None:
+            return np.zeros(0, dtype = np.int64)
+        return self.read_postings(entry)
+
+    def find_all(self, terms):
+        """
+        Returns the offsets of the sentences that contain all terms,
+        intersecting the posting lists from the shortest one up.
+        """
+        entries = []
+        for term in terms:
+            entry = self.find_entry(term)
+            if entry is None:
+                return np.zeros(0, dtype = np.int64)
+            entries.append(entry)
+        entries.sort(key = lambda entry: entry[3])
+
+        offsets = self.read_postings(entries[0])
+        for entry in entries[1:]:
+            if len(offsets) == 0:
+                break
+            postings = self.read_postings(entry)
+            positions = np.searchsorted(postings, offsets).clip(max = len(postings) - 1)
+            offsets = offsets[postings[positions] == offsets]
+        return offsets
+
+    def close(self):
+        for data in [self.terms, self.entries, self.postings]:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+def map_file(path):
+    """
+    Maps a file into memory; empty files, which cannot be mapped, are read
+    as an empty string.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+class ConcordanceLine:
+    def __init__(self, source, offset, left, keyword, right):
+        self.source = source
+        self.offset = offset
+        self.left = left
+        self.keyword = keyword
+        self.right = right
+
+    def format(self, width):
+        return u"{0:>{width}} [{1}] {2}".format(self.left[-width:], self.keyword, self.right[:width], width = width)
+
+class ConcordanceIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = {"sources": {}, "segments": []}
+        if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+            with open(os.path.join(directory, MANIFEST_FILE)) as f:
+                self.manifest = json.load(f)
+        self.segments = None
+
+    def save_manifest(self):
+        tmp_path = os.path.join(self.directory, MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.rename(tmp_path, os.path.join(self.directory, MANIFEST_FILE))
+
+    def add_file(self, path):
+        """
+        Indexes a file, or the part appended to it since it was last
+        indexed. Returns the number of new sentences. Raises a ValueError
+        without indexing anything if the events file of a candidates file
+        does not have one line per sentence, since the events are matched to
+        the sentences by position.
+        """
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        source = self.manifest["sources"].get(path)
+        if source is not None and (size < source["end"] or file_checksum(path, source["end"]) != source["checksum"]):
+            self.remove_file(path)
+            source = None
+        if source is None:
+            source = {"end": 0, "sentences": 0, "checksum": 0}
+        if size == source["end"]:
+            self.compact(path)
+            return 0
+
+        events = None
+        events_file = None
+        if source_format(path) == "conll":
+            events_path = events_path_for(path)
+            if events_path is not None:
+                with open(path, "rb") as f:
+                    f.seek(source["end"])
+                    sentence_count = source["sentences"] + count_conll_sentences(f)
+                event_count = count_lines(events_path)
+                # E.g. a sentence whose event could not be written, or events
+                # that have not been written yet
+                if event_count != sentence_count:
+                    raise ValueError("{0} has {1} events for {2} sentences".format(events_path, event_count, sentence_count))
+                events_file = open(events_path)
+                events = iter(events_file)
+                for _ in xrange(source["sentences"]):
+                    next(events, None)
+
+        new_sentences = 0
+        with open(path, "rb") as f:
+            f.seek(source["end"])
+            if source_format(path) == "conll":
+                sentences = read_conll_sentences(f, events)
+            else:
+                sentences = read_text_sentences(f)
+
+            postings = {}
+            start = source["end"]
+            pending_sentences = 0
+            for offset, end, terms in sentences:
+                for term in terms:
+                    try:
+                        postings[term].append(offset)
+                    except KeyError:
+                        postings[term] = array("l", [offset])
+                new_sentences += 1
+                pending_sentences += 1
+                source["end"] = end
+                if pending_sentences == SEGMENT_SENTENCES:
+                    self.add_segment(path, start, source["end"], pending_sentences, postings)
+                    postings = {}
+                    start = source["end"]
+                    pending_sentences = 0
+            if postings:
+                self.add_segment(path, start, source["end"], pending_sentences, postings)
+
+        if events_file is not None:
+            events_file.close()
+        source["sentences"] += new_sentences
+        source["checksum"] = file_checksum(path, source["end"])
+        self.manifest["sources"][path] = source
+        self.save_manifest()
+        self.compact(path)
+        return new_sentences
+
+    def segment_path(self, segment_id):
+        return os.path.join(self.directory, "{0:05d}".format(segment_id))
+
+    def add_segment(self, path, start, end, sentences, postings):
+        segment_id = max([segment["id"] for segment in self.manifest["segments"]] or [-1]) + 1
+        write_segment(self.segment_path(segment_id), postings)
+        self.manifest["segments"].append({"id": segment_id, "source": path, "start": start, "end": end,
+            "sentences": sentences})
+
+    def remove_segment_files(self, segment):
+        for suffix in [".terms", ".tidx", ".post"]:
+            os.remove(self.segment_path(segment["id"]) + suffix)
+
+    def remove_file(self, path):
+        """
+        Drops a file from the index. The manifest is saved before the
+        segment files are removed, so that it never refers to missing files.
+        """
+        removed = [segment for segment in self.manifest["segments"] if segment["source"] == path]
+        self.manifest["segments"] = [segment for segment in self.manifest["segments"] if segment["source"] != path]
+        self.manifest["sources"].pop(path, None)
+        self.save_manifest()
+        for segment in removed:
+            self.remove_segment_files(segment)
+        self.close()
+
+    def compact(self, path):
+        """
+        Merges MERGE_FACTOR segments of a source whenever there are that many
+        of the same tier (see segment_tier), smallest tier first, until no
+        tier has that many. Returns the number of segments merged.
+        """
+        merged = 0
+        while True:
+            tiers = {}
+            for segment in self.manifest["segments"]:
+                if segment["source"] == path and segment_sentences(segment) < SEGMENT_SENTENCES:
+                    tiers.setdefault(segment_tier(segment_sentences(segment)), []).append(segment)
+            candidates = [segments for _, segments in sorted(tiers.items()) if len(segments) >= MERGE_FACTOR]
+            if not candidates:
+                return merged
+            self.merge_segments(candidates[0][:MERGE_FACTOR])
+            merged += MERGE_FACTOR
+
+    def merge_segments(self, segments):
+        """
+        Replaces segments of one source by a single segment. The new segment
+        is in the manifest before the old files are removed.
+        """
+        segment_id = max(segment["id"] for segment in self.manifest["segments"]) + 1
+        opened = [Segment(self.segment_path(segment["id"]), segment["source"]) for segment in segments]
+        try:
+            write_segment_terms(self.segment_path(segment_id), merge_segment_terms(opened))
+        finally:
+            for segment in opened:
+                segment.close()
+
+        merged_ids = set(segment["id"] for segment in segments)
+        position = min(idx for idx, segment in enumerate(self.manifest["segments"]) if segment["id"] in merged_ids)
+        remaining = [segment for segment in self.manifest["segments"] if segment["id"] not in merged_ids]
+        remaining.insert(position, {"id": segment_id, "source": segments[0]["source"],
+            "start": min(segment["start"] for segment in segments), "end": max(segment["end"] for segment in segments),
+            "sentences": sum(segment_sentences(segment) for segment in segments)})
+        self.manifest["segments"] = remaining
+        self.save_manifest()
+        for segment in segments:
+            self.remove_segment_files(segment)
+        # Open segments may be among the removed ones
+        self.close()
+
+    def open_segments(self):
+        if self.segments is None:
+            self.segments = [Segment(self.segment_path(segment["id"]), segment["source"])
+                    for segment in self.manifest["segments"]]
+        return self.segments
+
+    def find(self, terms):
+        """
+        Returns a (source, offsets) pair for every source with sentences
+        that contain all terms, with the offsets in the order of the file.
+        """
+        keys = ["{0}:{1}".format(*parse_term(term)) for term in terms]
+        sources = []
+        offsets_by_source = {}
+        for segment in self.open_segments():
+            offsets = segment.find_all(keys)
+            if len(offsets) > 0:
+                if segment.source not in offsets_by_source:
+                    sources.append(segment.source)
+                offsets_by_source.setdefault(segment.source, []).append(offsets)
+        return [(source, sorted_offsets(offsets_by_source[source])) for source in sources]
+
+    def concordance(self, terms, limit = 20, context_words = 10):
+        """
+        Returns the concordance lines of the first limit matching sentences
+        and the total number of matches.
+        """
+        lines = []
+        parsed_terms = [parse_term(term) for term in terms]
+        matches = self.find(terms)
+        first_matches = [(source, offset) for source, offsets in matches for offset in offsets[:limit].tolist()]
+        for source, offset in first_matches[:limit]:
+            tokens = read_tokens(source, offset)
+            position = keyword_position(tokens, parsed_terms)
+            words = [word.decode("utf-8", "replace") for word, _ in tokens]
+            lines.append(ConcordanceLine(source, offset, u" ".join(words[max(position - context_words, 0):position]),
+                words[position] if words else u"", u" ".join(words[position + 1:position + 1 + context_words])))
+        return lines, sum(len(offsets) for _, offsets in matches)
+
+    def close(self):
+        for segment in self.segments or []:
+            segment.close()
+        self.segments = None
+
+def read_tokens(source, offset):
+    """
+    The (word, lemma) pairs of the sentence at offset; lemmas are None in
+    sentence lists.
+    """
+    with open(source, "rb") as f:
+        f.seek(offset)
+        if source_format(source) == "text":
+            return [(word, None) for word in f.readline().partition(",")[2].split()]
+        tokens = []
+        for line in f:
+            row = line.split("\t")
+            if len(row) <= 3:
+                break
+            tokens.append((row[1], row[3]))
+        return tokens
+
+def keyword_position(tokens, parsed_terms):
+    """
+    Position of the first token matched by one of the terms (a trigger
+    matches words starting with it, as the sentence lists use stems).
+    """
+    for kind, value in parsed_terms:
+        for position, (word, lemma) in enumerate(tokens):
+            if kind in ("lemma", "event", "trigger") and lemma == value:
+                return position
+            if kind == "word" and normalise_word(word) == value:
+                return position
+            if kind == "trigger" and lemma is None and normalise_word(word).startswith(value):
+                return position
+    return 0
+
+def expand_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for file_ in sorted(os.listdir(path)):
+                if file_.endswith(".lmtp"):
+                    yield os.path.join(path, file_)
+        else:
+            yield path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Indexes candidate sentences and prints concordances")
+    subparsers = parser.add_subparsers(dest = "command")
+    index_parser = subparsers.add_parser("index", help = "Index new files and whatever was appended to indexed ones")
+    index_parser.add_argument("index_dir")
+    index_parser.add_argument("files", nargs = "+",
+            help = "Candidates (.lmtp) files, sentence lists, or directories with .lmtp files")
+    query_parser = subparsers.add_parser("query", help = "Print the sentences that contain all terms")
+    query_parser.add_argument("index_dir")
+    query_parser.add_argument("terms", nargs = "+")
+    query_parser.add_argument("--limit", default = 20, type = int)
+    query_parser.add_argument("--context-words", default = 10, type = int)
+    query_parser.add_argument("--width", default = 60, type = int)
+    args = parser.parse_args()
+
+    if args.command == "index":
+        if not os.path.isdir(args.index_dir):
+            os.makedirs(args.index_dir)
+        index = ConcordanceIndex(args.index_dir)
+        for path in expand_paths(args.files):
+            start = time.time()
+            try:
+                new_sentences = index.add_file(path)
+            except ValueError as e:
+                print "{0}: not indexed ({1})".format(path, e)
+                continue
+            print "{0}: {1} new sentences ({2:.2f}s)".format(path, new_sentences, time.time() - start)
+    else:
+        index = ConcordanceIndex(args.index_dir)
+        start = time.time()
+        lines, match_count = index.concordance([term.strip() for term in args.terms], args.limit, args.context_words)
+        elapsed = time.time() - start
+        for line in lines:
+            print line.format(args.width).encode("utf-8")
+        print "{0} sentences in {1:.1f}ms".format(match_count, elapsed * 1000)
+        index.close()
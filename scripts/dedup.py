@@ -0,0 +1,91 @@
+# Suppression of repeated sentences (e.g. web boilerplate) before they are
+# decoded and analysed.
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+class BloomFilter:
+    """
+    Set membership with a fixed memory budget and a configurable false
+    positive rate. Given a filename, the bits live in a memory-mapped file
+    so that several worker processes can share one filter. Concurrent
+    updates are not locked; a lost update only means that a duplicate may
+    occasionally go undetected.
+    """
+    def __init__(self, capacity, error_rate, filename = None):
+        if not 0 < error_rate < 1:
+            raise ValueError("Error rate must be between 0 and 1, got {0}".format(error_rate))
+        self.bit_count = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, int(round(self.bit_count / float(capacity) * math.log(2))))
+        byte_count = (self.bit_count + 7) // 8
+
+        self.filename = filename
+        if filename is None:
+            self.bits = bytearray(byte_count)
+        else:
+            with open(filename, "a+b") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    f.truncate(byte_count)
+                elif f.tell() != byte_count:
+                    raise ValueError("{0} was created for a different capacity or error rate".format(filename))
+                self.bits = mmap.mmap(f.fileno(), byte_count)
+
+    @property
+    def memory_size(self):
+        return len(self.bits)
+
+    def add(self, digest):
+        """
+        Adds an item given by a digest of at least 16 bytes. Returns True if
+        the item was not in the filter before.
+        """
+        h1, h2 = struct.unpack("<QQ", digest[:16])
+        bits = self.bits
+        shared = self.filename is not None
+        is_new = False
+        for idx in xrange(self.hash_count):
+            bit = (h1 + idx * h2) % self.bit_count
+            byte_idx = bit >> 3
+            mask = 1 << (bit & 7)
+            # Indexing a mmap yields characters instead of integers
+            byte = ord(bits[byte_idx]) if shared else bits[byte_idx]
+            if not byte & mask:
+                is_new = True
+                bits[byte_idx] = chr(byte | mask) if shared else byte | mask
+        return is_new
+
+    def close(self):
+        if self.filename is not None:
+            self.bits.close()
+
+class DuplicateFilter:
+    """
+    Recognises sentences whose token and lemma sequence has been seen
+    before. Meant to be passed as the deduplicator of a PipelineProcessor,
+    which consults it before the dependency tree of a sentence is built.
+    """
+    def __init__(self, bloom_filter):
+        self.bloom_filter = bloom_filter
+        self.sentence_count = 0
+        self.duplicate_count = 0
+
+    def accept_rows(self, rows):
+        self.sentence_count += 1
+        try:
+            key = "\n".join(["{0}\t{1}".format(row[1], row[3]) for row in rows])
+        except IndexError:
+            # Leave malformed sentences to the decoder
+            return True
+        if self.bloom_filter.add(hashlib.md5(key).digest()):
+            return True
+        self.duplicate_count += 1
+        return False
+
+    def __str__(self):
+        return "{0} duplicates among {1} sentences ({2:.1f}%)".format(
+                self.duplicate_count, self.sentence_count,
+                100.0 * self.duplicate_count / max(self.sentence_count, 1))
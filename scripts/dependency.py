@@ -1,20 +1,48 @@
+import io
 import os
 import gzip
 
-class DependencyNode:
-    def __init__(self, id, word, lemma, pos_tag):
+from collections import Counter
+
+from vocabulary import VOCABULARY, NO_LABEL, Vocabulary
+
+class DependencyNode(object):
+    """
+    A token of a parsed sentence. Words, lemmas, POS tags and relation labels
+    are stored as ids in the shared VOCABULARY; the string attributes
+    resolve them on access.
+    """
+    __slots__ = ("id", "word_id", "lemma_id", "pos_tag_id", "children", "parent", "parent_relation_label_id")
+
+    def __init__(self, id, word_id, lemma_id, pos_tag_id):
         self.id = id
-        self.word = word
-        self.lemma = lemma
-        self.pos_tag = pos_tag
+        self.word_id = word_id
+        self.lemma_id = lemma_id
+        self.pos_tag_id = pos_tag_id
         self.children = []
         self.parent = None
-        self.parent_relation_label = "--"
+        self.parent_relation_label_id = NO_LABEL
 
-    def add_child(self, child, label):
-        self.children.append((child, label))
+    def add_child(self, child, label_id):
+        self.children.append((child, label_id))
         child.parent = self
-        child.parent_relation_label = label
+        child.parent_relation_label_id = label_id
+
+    @property
+    def word(self):
+        return VOCABULARY.strings[self.word_id]
+
+    @property
+    def lemma(self):
+        return VOCABULARY.strings[self.lemma_id]
+
+    @property
+    def pos_tag(self):
+        return VOCABULARY.strings[self.pos_tag_id]
+
+    @property
+    def parent_relation_label(self):
+        return VOCABULARY.strings[self.parent_relation_label_id]
 
     @property
     def is_root(self):
@@ -27,11 +55,15 @@ class DependencyNode:
     def __str__(self):
         return self.to_str()
 
+    @property
+    def vocabulary(self):
+        return VOCABULARY
+
     def to_str(self, level = 0, label = None):
         base_str = "{1} ({2}); {3}".format(self.id, self.word, self.lemma, self.pos_tag)
 
-        if label:
-            base_str = "{0}: {1}".format(label,base_str)
+        if label is not None:
+            base_str = "{0}: {1}".format(self.vocabulary.strings[label],base_str)
 
         ident_str = "\t" * level
         base_str = ident_str + base_str
@@ -43,6 +75,11 @@ class DependencyNode:
         return "\n".join(str_components)
 
     def find_children_by_label(self, match_label):
+        """
+        Takes the id of the label (or the label itself, which is slower).
+        """
+        if isinstance(match_label, basestring):
+            match_label = self.vocabulary.lookup(match_label)
         matches = []
         for child, label in self.children:
             if label == match_label:
@@ -58,8 +95,10 @@ class DependencyNode:
 	
     # Finds all of the children that have the given pos_tag
     def find_children_by_POS_tag(self, pos_tag):
+        if isinstance(pos_tag, basestring):
+            pos_tag = self.vocabulary.lookup(pos_tag)
         for child, label in self.children:
-            if child.pos_tag == pos_tag:
+            if child.pos_tag_id == pos_tag:
                 yield child.word
 
 
@@ -79,52 +118,312 @@ class DependencyNode:
         result.append(self)
         return result
 
-def process_conll_stream(instream, processor):
+class LocalDependencyNode(DependencyNode):
+    """
+    A DependencyNode whose ids refer to its own vocabulary instead of the
+    shared one, e.g. one per request of a long-running service, so that
+    decoding does not grow the shared VOCABULARY forever.
+    """
+    __slots__ = ("vocabulary",)
+
+    def __init__(self, id, word_id, lemma_id, pos_tag_id, vocabulary):
+        DependencyNode.__init__(self, id, word_id, lemma_id, pos_tag_id)
+        self.vocabulary = vocabulary
+
+    @property
+    def word(self):
+        return self.vocabulary.strings[self.word_id]
+
+    @property
+    def lemma(self):
+        return self.vocabulary.strings[self.lemma_id]
+
+    @property
+    def pos_tag(self):
+        return self.vocabulary.strings[self.pos_tag_id]
+
+    @property
+    def parent_relation_label(self):
+        return self.vocabulary.strings[self.parent_relation_label_id]
+
+# Records beyond these limits are rejected instead of read into memory
+MAX_TOKENS_PER_SENTENCE = 1000
+MAX_LINE_BYTES = 10000
+READ_BUFFER_SIZE = 1 << 16
+# Strings in a reader's own vocabulary (see ConllReader) before it is replaced
+LOCAL_VOCABULARY_SIZE = 1 << 12
+
+class ErrorReport:
+    """
+    Counts rejected records by category and optionally appends them to a
+    quarantine file with one line per record: source, offset, category,
+    reason and the start of the record. `position` holds the source and
+    offset of the sentence currently being processed, so that pipeline
+    errors can be attributed to it.
+    """
+    def __init__(self, quarantine_filename = None, snippet_bytes = 200):
+        self.counts = Counter()
+        self.snippet_bytes = snippet_bytes
+        self.quarantine = None
+        if quarantine_filename is not None:
+            self.quarantine = open(quarantine_filename, "a")
+        self.position = ("", 0)
+
+    def record(self, category, reason, source = None, offset = None, snippet = ""):
+        self.counts[category] += 1
+        if self.quarantine is None:
+            return
+        if source is None:
+            source, offset = self.position
+        snippet = snippet[:self.snippet_bytes].replace("\t", " ").replace("\n", " ")
+        self.quarantine.write("{0}\t{1}\t{2}\t{3}\t{4}\n".format(
+            source, offset, category, str(reason).replace("\t", " ").replace("\n", " "), snippet))
+
+    def record_exception(self, category, exception, source = None, offset = None, snippet = ""):
+        self.record(category, "{0}: {1}".format(type(exception).__name__, exception), source, offset, snippet)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def __str__(self):
+        if not self.counts:
+            return "no errors"
+        return ", ".join("{0} {1}".format(count, category) for category, count in sorted(self.counts.items()))
+
+    def close(self):
+        if self.quarantine is not None:
+            self.quarantine.close()
+            self.quarantine = None
+
+class ConllReader:
+    """
+    Reads the sentences of a CoNLL stream with bounded memory. Lines longer
+    than max_line_bytes and sentences with more than max_tokens tokens are
+    rejected without being kept in memory; like malformed sentences they
+    are reported to the ErrorReport and reading resumes after the next
+    blank line.
+
+    With a vocabulary_size, sentences are decoded into a vocabulary of the
+    reader's own, which is replaced by a new one once it holds that many
+    strings, rather than into the shared VOCABULARY, which keeps every
+    string of the corpus. Their ids then only hold within a sentence.
+    """
+    def __init__(self, instream, source = "", errors = None,
+            max_tokens = MAX_TOKENS_PER_SENTENCE, max_line_bytes = MAX_LINE_BYTES, vocabulary_size = None):
+        if max_tokens < 1 or max_line_bytes < 1:
+            raise ValueError("The token and line limits must be positive")
+        self.instream = instream
+        self.source = source
+        self.errors = errors if errors is not None else ErrorReport()
+        self.max_tokens = max_tokens
+        self.max_line_bytes = max_line_bytes
+        self.vocabulary_size = vocabulary_size
+        self.vocabulary = None
+        self.offset = 0
+        # Lines are read up to one byte past the limit; streams without
+        # readline (e.g. generators) are consumed line by line
+        self.readline = getattr(instream, "readline", None)
+        if self.readline is None:
+            lines = iter(instream)
+            self.readline = lambda size: next(lines, "")
+
+    def skip_rest_of_line(self, line):
+        while len(line) > 0 and not line.endswith("\n"):
+            line = self.readline(self.max_line_bytes + 1)
+            self.offset += len(line)
+
+    def read_rows(self, split_lines = True):
+        """
+        Returns the split lines of the next sentence that respects the limits,
+        or None at the end of the stream. With split_lines = False the lines
+        are returned as they were read.
+        """
+        readline = self.readline
+        line_limit = self.max_line_bytes + 1
+        while True:
+            start = self.offset
+            rows = []
+            error = None
+            snippet = ""
+            while True:
+                line = readline(line_limit)
+                self.offset += len(line)
+                if len(line) == 0:
+                    break
+                if len(line) > self.max_line_bytes:
+                    self.skip_rest_of_line(line)
+                    if error is None:
+                        error = ("line_too_long", "Line longer than {0} bytes".format(self.max_line_bytes))
+                        snippet = line
+                    continue
+                if len(line.strip()) == 0:
+                    if rows or error is not None:
+                        break
+                    start = self.offset
+                    continue
+                if error is not None:
+                    continue
+                if len(rows) >= self.max_tokens:
+                    error = ("too_many_tokens", "More than {0} tokens".format(self.max_tokens))
+                    snippet = "\t".join(rows[0]) if split_lines else rows[0]
+                    rows = []
+                    continue
+                rows.append(line.split() if split_lines else line)
+
+            if error is not None:
+                self.errors.record(error[0], error[1], self.source, start, snippet)
+                continue
+            if len(rows) == 0:
+                return None
+            self.errors.position = (self.source, start)
+            return rows
+
+    def next_parse(self, accept_rows = None, vocabulary = None):
+        """
+        Decodes the next well-formed sentence that accept_rows (if given)
+        accepts and returns the root nodes of its trees, or None at the end of
+        the stream. See build_conll_tree for the vocabulary.
+        """
+        while True:
+            rows = self.read_rows()
+            if rows is None:
+                return None
+            if accept_rows is not None and not accept_rows(rows):
+                continue
+            if vocabulary is None and self.vocabulary_size:
+                if self.vocabulary is None or len(self.vocabulary) >= self.vocabulary_size:
+                    self.vocabulary = Vocabulary()
+                vocabulary = self.vocabulary
+            try:
+                return build_conll_tree(rows, vocabulary)
+            except (ValueError, IndexError) as e:
+                self.errors.record_exception("malformed_row", e, snippet = "\t".join(rows[0]))
+            except KeyError as e:
+                self.errors.record("missing_root", "No token is attached to the root", snippet = "\t".join(rows[0]))
+
+def reader_for(instream, processor, source = "", errors = None, **limits):
+    if errors is None:
+        errors = getattr(processor, "errors", None)
+    return ConllReader(instream, source, errors, **limits)
+
+def process_conll_stream(instream, processor, source = "", errors = None, **limits):
+    reader = reader_for(instream, processor, source, errors, **limits)
+    accept_rows = getattr(processor, "accept_rows", None)
     while True:
-        new_parse = decode_conll_parse(instream)
+        new_parse = reader.next_parse(accept_rows)
         if new_parse is None:
             break
         should_continue = processor(new_parse)
         if not should_continue:
             break
 
-def process_sdewac_splits(root_directory, processor, start_split = 0, split_num = -1):
+def process_conll_stream_batched(instream, processor, batch_size, source = "", errors = None, **limits):
+    """
+    Like process_conll_stream, but hands the processor lists of up to
+    batch_size parses at a time.
+    """
+    reader = reader_for(instream, processor, source, errors, **limits)
+    accept_rows = getattr(processor, "accept_rows", None)
+    while True:
+        batch = []
+        while len(batch) < batch_size:
+            new_parse = reader.next_parse(accept_rows)
+            if new_parse is None:
+                break
+            batch.append(new_parse)
+        if len(batch) == 0:
+            break
+        should_continue = processor(batch)
+        if not should_continue or len(batch) < batch_size:
+            break
+
+def select_splits(root_directory, start_split = 0, split_num = -1):
     all_files = sorted(os.listdir(root_directory))
     if split_num == -1:
-        all_files = all_files[start_split:]
+        return all_files[start_split:]
     else:
-        all_files = all_files[start_split:start_split + split_num]
-    for file_ in all_files:
-        try:
-            file_path = os.path.join(root_directory, file_)
-            with gzip.open(file_path, 'rb') as f:
-                process_conll_stream(f, processor)
-        except Exception as e:
-            print "Skipping file: {0}".format(file_)
-
-def decode_conll_parse(instream):
+        return all_files[start_split:start_split + split_num]
+
+def process_sdewac_splits(root_directory, processor, start_split = 0, split_num = -1, batch_size = 0, errors = None,
+        progress = None, **limits):
+    """
+    Processes all selected splits. Errors are counted in the given
+    ErrorReport, or in the processor's `errors` if it has one; a file that
+    cannot be read to the end is reported as a file_error and the remaining
+    files are still processed. Offsets refer to the uncompressed files.
+    A progress.ProgressTracker is told about every file that is opened.
+    """
+    if errors is None:
+        errors = getattr(processor, "errors", None) or ErrorReport()
+    for file_ in select_splits(root_directory, start_split, split_num):
+        process_sdewac_file(root_directory, file_, processor, batch_size, errors, progress, **limits)
+
+def process_sdewac_file(root_directory, file_, processor, batch_size = 0, errors = None, progress = None, **limits):
+    if errors is None:
+        errors = getattr(processor, "errors", None) or ErrorReport()
+    errors.position = (file_, 0)
     try:
-        raw_nodes_by_parents = {}
-        for line in instream:
-            if len(line.strip()) == 0:
-                break
-            components = line.split()
-            id = int(components[0].split("_")[1])
-            raw_nodes_by_parents.setdefault(int(components[9]), []).append((DependencyNode(id, components[1], components[3], components[5]), components[11]))
+        with open(os.path.join(root_directory, file_), 'rb') as raw_file:
+            if progress is not None:
+                progress.start_file(file_, raw_file)
+            try:
+                # BufferedReader makes reading lines of bounded length much faster
+                with io.BufferedReader(gzip.GzipFile(fileobj = raw_file, mode = 'rb'), READ_BUFFER_SIZE) as f:
+                    if batch_size > 0:
+                        process_conll_stream_batched(f, processor, batch_size, file_, errors, **limits)
+                    else:
+                        process_conll_stream(f, processor, file_, errors, **limits)
+            finally:
+                if progress is not None:
+                    progress.finish_file(file_)
+    except Exception as e:
+        # Recorded at the last sentence that was read from the file
+        errors.record_exception("file_error", e)
 
-        if len(raw_nodes_by_parents) == 0:
-            return None
+def build_conll_tree(rows, vocabulary = None):
+    """
+    Builds the dependency trees of a sentence from its rows and returns
+    their root nodes. Raises ValueError or IndexError for malformed rows and
+    KeyError if no token is attached to the root. Strings are added to the
+    shared VOCABULARY unless another vocabulary is given, in which case the
+    nodes are LocalDependencyNodes referring to it.
+    """
+    if vocabulary is None:
+        add_string = VOCABULARY.add
+        create_node = DependencyNode
+    else:
+        add_string = vocabulary.add
+        create_node = lambda id, word_id, lemma_id, pos_tag_id: LocalDependencyNode(
+                id, word_id, lemma_id, pos_tag_id, vocabulary)
+    raw_nodes_by_parents = {}
+    last_id = 0
+    for components in rows:
+        id = int(components[0].split("_")[1])
+        # Repeated ids (e.g. sentences run together) would multiply subtrees
+        if id <= last_id:
+            raise ValueError("Token id {0} follows {1}".format(id, last_id))
+        last_id = id
+        raw_nodes_by_parents.setdefault(int(components[9]), []).append((
+            create_node(id, add_string(components[1]), add_string(components[3]), add_string(components[5])),
+            add_string(components[11])))
 
-        root_nodes = list(map(lambda n: n[0], raw_nodes_by_parents[0]))
-        for root_node in root_nodes:
-            unprocessed_nodes = [root_node]
-            while len(unprocessed_nodes) > 0:
-                node = unprocessed_nodes.pop()
-                for child, relation_label in raw_nodes_by_parents.get(node.id, []):
-                    node.add_child(child, relation_label)
-                    unprocessed_nodes.append(child)
+    root_nodes = list(map(lambda n: n[0], raw_nodes_by_parents[0]))
+    for root_node in root_nodes:
+        unprocessed_nodes = [root_node]
+        while len(unprocessed_nodes) > 0:
+            node = unprocessed_nodes.pop()
+            for child, relation_label in raw_nodes_by_parents.get(node.id, []):
+                node.add_child(child, relation_label)
+                unprocessed_nodes.append(child)
 
-        return root_nodes
-    except ValueError:
-        return None
+    return root_nodes
 
+def decode_conll_parse(instream, accept_rows = None, vocabulary = None):
+    """
+    Decodes the next sentence of the stream, skipping malformed ones. If
+    accept_rows is given, it is called with the rows of every sentence
+    before its tree is built, and sentences it rejects are skipped. See
+    build_conll_tree for the vocabulary.
+    """
+    return ConllReader(instream).next_parse(accept_rows, vocabulary)
@@ -3,25 +3,40 @@
 import subprocess
 import argparse
 import dependency
+import vocabulary
+import dedup
+import sampling
+import progress
 import copy
+import os
 import sys
+import itertools
+import functools
 
 from collections import Counter
+from heavy_hitters import SpaceSavingCounter
 
 HDPRO_PATH = "/Users/juliussteen/Downloads/de.uniheidelberg.cl.hdpro.german-pipelines-0.3-with-dependencies.jar"
+HDPRO_MODEL = "sprml13-german-train-predicted-fullzmorgelemma"
 BLANK_STR = "_"
-POS_ADV = "ADV"
-POS_NICHT = "PTKNEG"
-POS_PPER = "PPER"
+POS_ADV = vocabulary.POS_ADV
+POS_NICHT = vocabulary.POS_PTKNEG
+POS_PPER = vocabulary.POS_PPER
 
-def run_hdpro(filename):
-    subprocess.call(["java", "-jar", HDPRO_PATH,
+def run_hdpro(filename, model = HDPRO_MODEL, output = None):
+    """
+    Parses the sentences in a text file; the CoNLL 2009 parses are written
+    to stdout or to the given output file. Returns the exit code of the
+    parser. See parse_cache.py for parsing only the sentences that have not
+    been parsed before.
+    """
+    return subprocess.call(["java", "-jar", HDPRO_PATH,
             "MPNBE",
             "p",
             "-it", "TEXT",
             "-if", filename,
             "-ot", "CONLL2009",
-            "-mv", "sprml13-german-train-predicted-fullzmorgelemma"])
+            "-mv", model], stdout = output)
 
 def is_complex_sentence(sentence):
     return sentence.is_complex_sentence
@@ -35,7 +50,7 @@ class has_embedding_depth_between:
         return sentence.embedding_depth >= self.min_ and sentence.embedding_depth >= self.max_
 
 def has_named_entity_subject(sentence):
-    return sentence.subject_node.pos_tag == "NE"
+    return sentence.subject_node.pos_tag_id == vocabulary.POS_NE
 
 def has_no_unresolved_pronouns(sentence):
     return not sentence.has_unresolved_pronoun
@@ -46,22 +61,23 @@ def has_trigger_pred(sentence):
 def is_not_reflexive(sentence):
     if sentence.is_complex_sentence:
         return is_not_reflexive(sentence.object_node)
-    return sentence.object_node.pos_tag != "PRF"
+    return sentence.object_node.pos_tag_id != vocabulary.POS_PRF
 
 class get_trigger_predicate:
     def __init__(self, triggers_filename):
         with open(triggers_filename, "r") as f:
             self.triggers = set([(w.split()[0].strip().lower(), 1 if w.split()[1] == "+" else -1) for w in f if not w.startswith("#")])
+        # Keyed by trigger rather than by the lemmas seen, which would grow
+        # with the corpus; the first match in the set wins, as before
+        self.matches = {}
+        for trig, polarity in self.triggers:
+            self.matches.setdefault(trig, (trig, polarity))
 
     def __call__(self, predicate):
-        match = [(trig, polarity) for trig, polarity in self.triggers if predicate.lemma.lower() == trig]
-        if len(match) is not 0:
-            return match[0][0], match[0][1]
-        else:
-            return [None, None]
+        return self.matches.get(predicate.lemma.lower(), [None, None])
 
 def has_unmodified_predicate(sentence):
-    return len(sentence.predicate_node.find_children_by_label("MO")) == 0
+    return len(sentence.predicate_node.find_children_by_label(vocabulary.LABEL_MO)) == 0
 
 class SentenceWriter:
     def __init__(self, filename):
@@ -69,24 +85,43 @@ class SentenceWriter:
         self.sentence_counter = 0
 
     def __call__(self, root_nodes, local_context):
-        all_nodes = []
-        for node in root_nodes:
-            all_nodes += node.all_tree_nodes
-
+        text = self.format_sentence(root_nodes, self.sentence_counter)
         with open(self.filename, "a") as f:
-            for sid, node in enumerate(sorted(all_nodes, key = lambda n: n.id)):
-                tid = "{0}_{1}".format(self.sentence_counter, node.id)
-                parent_id = 0
-                if node.parent:
-                    parent_id = node.parent.id
-                f.write("{0}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}\t{10}\t{11}\t{12}\t{13}\t\n"\
-                        .format(tid, node.word, "_", node.lemma, "_", node.pos_tag, "_", "_", "_", parent_id, "_", node.parent_relation_label, "_", "_")
-                        )
-            f.write("\n")
+            f.write(text)
         self.sentence_counter += 1
 
         return PipelineProcessingStatus.CONTINUE
 
+    def process_batch(self, contexts):
+        # Formatted completely first, so that nothing is written if a
+        # sentence fails and the batch is retried sentence by sentence
+        texts = [self.format_sentence(context.root_nodes, self.sentence_counter + idx)
+                for idx, context in enumerate(contexts)]
+        with open(self.filename, "a") as f:
+            f.writelines(texts)
+        self.sentence_counter += len(texts)
+
+        return PipelineProcessingStatus.CONTINUE, contexts
+
+    def format_sentence(self, root_nodes, sentence_id):
+        all_nodes = []
+        for node in root_nodes:
+            all_nodes += node.all_tree_nodes
+
+        lines = []
+        for sid, node in enumerate(sorted(all_nodes, key = lambda n: n.id)):
+            strings = node.vocabulary.strings
+            tid = "{0}_{1}".format(sentence_id, node.id)
+            parent_id = 0
+            if node.parent:
+                parent_id = node.parent.id
+            lines.append("{0}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}\t{10}\t{11}\t{12}\t{13}\t\n"\
+                    .format(tid, strings[node.word_id], "_", strings[node.lemma_id], "_", strings[node.pos_tag_id],
+                        "_", "_", "_", parent_id, "_", strings[node.parent_relation_label_id], "_", "_")
+                    )
+        lines.append("\n")
+        return "".join(lines)
+
 class SentenceAnalyser:
     def __init__(self, get_trigger_predicate):
         self.get_trigger_predicate = get_trigger_predicate
@@ -100,6 +135,16 @@ class SentenceAnalyser:
         else:
             return PipelineProcessingStatus.DISCARD_NODES
 
+    def process_batch(self, contexts):
+        kept = []
+        for context in contexts:
+            longest_node = max(context.root_nodes, key = lambda n: n.child_count)
+            sentence = self.analyse_sentence(longest_node)
+            if sentence:
+                context.sentence = sentence
+                kept.append(context)
+        return PipelineProcessingStatus.CONTINUE, kept
+
     def analyse_sentence(self, root_node):
         subject, dir_object = self.get_subject_and_object_from_node(root_node)
         modifiers = self.get_modifiers(root_node)
@@ -108,7 +153,7 @@ class SentenceAnalyser:
         if subject and dir_object:
             return SentenceTuple(root_node, subject, dir_object, modifiers, trigger_pred, pred_polarity)
 
-        comp_phrase = root_node.find_child_by_label("OC")
+        comp_phrase = root_node.find_child_by_label(vocabulary.LABEL_OC)
 
         if comp_phrase:
             embeded_sentence = self.analyse_sentence(comp_phrase)
@@ -119,8 +164,8 @@ class SentenceAnalyser:
         return None
 
     def get_subject_and_object_from_node(self, root_node):
-        subject = root_node.find_child_by_label("SB")
-        dir_object = root_node.find_child_by_label("OA")
+        subject = root_node.find_child_by_label(vocabulary.LABEL_SB)
+        dir_object = root_node.find_child_by_label(vocabulary.LABEL_OA)
         return subject, dir_object
 
     def get_modifiers(self, root_node):
@@ -143,6 +188,11 @@ class SentenceFilter:
         else:
             return PipelineProcessingStatus.DISCARD_NODES
 
+    def process_batch(self, contexts):
+        for condition in self.conditions:
+            contexts = [context for context in contexts if condition(context.sentence)]
+        return PipelineProcessingStatus.CONTINUE, contexts
+
 class SentencePrinter:
     def __call__(self, root_nodes, local_context):
         print local_context.sentence
@@ -156,29 +206,51 @@ class SentenceCounter:
         self.count += 1
         return PipelineProcessingStatus.CONTINUE
 
+    def process_batch(self, contexts):
+        self.count += len(contexts)
+        return PipelineProcessingStatus.CONTINUE, contexts
+
 class CountIndicator:
     def __init__(self, counter, prefix, single_line, update_interval):
         self.counter = counter
         self.prefix = prefix
         self.update_interval = update_interval
         self.single_line = single_line
+        self.last_reported_count = 0
 
     def __call__(self, root_nodes, local_context):
         if self.counter.count % self.update_interval == 0:
-            sys.stdout.write(self.prefix + str(self.counter.count))
-            if self.single_line:
-                sys.stdout.write("\r")
-            else:
-                sys.stdout.write("\n")
-            sys.stdout.flush()
+            self.report()
         return PipelineProcessingStatus.CONTINUE
 
+    def process_batch(self, contexts):
+        if self.counter.count - self.last_reported_count >= self.update_interval:
+            self.report()
+        return PipelineProcessingStatus.CONTINUE, contexts
+
+    def report(self):
+        self.last_reported_count = self.counter.count
+        sys.stdout.write(self.prefix + str(self.counter.count))
+        if self.single_line:
+            sys.stdout.write("\r")
+        else:
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+
 class EntityCollector:
-    def __init__(self):
-        self.subj_position_entities_counter = Counter()
-        self.obj_position_entities_counter = Counter()
-        self.relation_counter = Counter()
-        self.entity_relation_counter = Counter()
+    """
+    Counts the entities in subject and object position as well as the
+    relations between them, keyed by word id (see
+    vocabulary.VOCABULARY.resolve). By default the counts are exact; pass a
+    factory for bounded counters (e.g. a SpaceSavingCounter) to cap the
+    memory used over large corpora.
+    """
+    def __init__(self, counter_factory = Counter):
+        self.counter_factory = counter_factory
+        self.subj_position_entities_counter = counter_factory()
+        self.obj_position_entities_counter = counter_factory()
+        self.relation_counter = counter_factory()
+        self.entity_relation_counter = counter_factory()
 
     def __call__(self, root_nodes, local_context):
         sentence = local_context.sentence
@@ -187,49 +259,55 @@ class EntityCollector:
         return PipelineProcessingStatus.CONTINUE
 
     def count_sentence(self, sentence):
-        all_entity_strs = []
+        all_entity_ids = []
         all_entity_nodes = []
         curr_sentence = sentence
 
         while curr_sentence.is_complex_sentence:
-            subj_str = curr_sentence.subject_node.word
-            all_entity_strs.append(subj_str)
+            subj_id = curr_sentence.subject_node.word_id
+            all_entity_ids.append(subj_id)
             all_entity_nodes.append(curr_sentence.subject_node)
-            self.subj_position_entities_counter[subj_str] += 1
+            self.subj_position_entities_counter.update((subj_id,))
 
             curr_sentence = curr_sentence.object_node
 
-        subj_str = sentence.subject_node.word
-        self.subj_position_entities_counter[subj_str] += 1
-        all_entity_strs.append(subj_str)
+        subj_id = sentence.subject_node.word_id
+        self.subj_position_entities_counter.update((subj_id,))
+        all_entity_ids.append(subj_id)
 
         all_entity_nodes.append(sentence.subject_node)
 
-        obj_str = curr_sentence.object_node.word
-        self.obj_position_entities_counter[obj_str] += 1
-        all_entity_strs.append(obj_str)
+        obj_id = curr_sentence.object_node.word_id
+        self.obj_position_entities_counter.update((obj_id,))
+        all_entity_ids.append(obj_id)
 
         all_entity_nodes.append(curr_sentence.object_node)
 
-        self.relation_counter.update(fold_forward(all_entity_strs))
-        self.entity_relation_counter.update(fold_forward(map(lambda n: n.word, filter(
-            lambda n: n.pos_tag == "NE",
-            all_entity_nodes
-            ))))
+        self.relation_counter.update(fold_forward(all_entity_ids))
+        self.entity_relation_counter.update(fold_forward(
+            n.word_id for n in all_entity_nodes if n.pos_tag_id == vocabulary.POS_NE
+            ))
+
+    def merge(self, other):
+        """
+        Combines the counts of two collectors, e.g. from parallel workers.
+        """
+        merged = EntityCollector(self.counter_factory)
+        merged.subj_position_entities_counter = self.subj_position_entities_counter + other.subj_position_entities_counter
+        merged.obj_position_entities_counter = self.obj_position_entities_counter + other.obj_position_entities_counter
+        merged.relation_counter = self.relation_counter + other.relation_counter
+        merged.entity_relation_counter = self.entity_relation_counter + other.entity_relation_counter
+        return merged
 
 def fold_forward(list_or_iter):
     """
-    Combines the elements in an iterable into two-tuples
+    Lazily combines the elements in an iterable into two-tuples
     so that each element is combined with all elements that follow it.
     """
     list_ = list(list_or_iter)
-    if len(list_) == 1:
-        return []
-    result = []
     for idx, elem1 in enumerate(list_):
-        for elem2 in list_[idx + 1:]:
-            result.append((elem1, elem2))
-    return result
+        for elem2 in itertools.islice(list_, idx + 1, None):
+            yield (elem1, elem2)
 
 class SentenceLimiter:
     def __init__(self, limit):
@@ -258,9 +336,27 @@ class PipelineContext(object):
     def __setattr__(self, attr_name, value):
         self.values[attr_name] = value
 
+def record_pipeline_error(errors, root_nodes, exception):
+    snippet = ""
+    if errors.quarantine is not None:
+        snippet = " ".join(node.flat_text for node in root_nodes)
+    errors.record_exception("pipeline_error", exception, snippet = snippet)
+
 class PipelineProcessor:
-    def __init__(self, *pipeline_components):
+    """
+    Runs every sentence through the pipeline components. An optional
+    deduplicator (see dedup.DuplicateFilter) is consulted with the raw rows
+    of each sentence before its tree is built, so repeated sentences are
+    skipped at almost no cost. Sentences on which a component fails are
+    counted in the `errors` report (a dependency.ErrorReport) and skipped.
+    """
+    def __init__(self, *pipeline_components, **options):
         self.pipeline_components = pipeline_components
+        self.deduplicator = options.get("deduplicator")
+        self.errors = options.get("errors") or dependency.ErrorReport()
+
+    def accept_rows(self, rows):
+        return self.deduplicator is None or self.deduplicator.accept_rows(rows)
 
     def __call__(self, root_nodes):
         try:
@@ -275,9 +371,155 @@ class PipelineProcessor:
                 elif status != PipelineProcessingStatus.CONTINUE:
                     raise RuntimeError("Status {0} is invalid", status)
         except Exception as e:
-            print "Skipping sentence {0} ({1})".format(root_nodes, e)
+            record_pipeline_error(self.errors, root_nodes, e)
         return True
 
+class FanOutProcessor:
+    """
+    Feeds every decoded sentence to several independent pipelines (branches),
+    e.g. to compare filter or lexicon variants in a single pass. The shared
+    components run once per sentence before the branches.
+
+    Components with a memo_key attribute must only depend on the sentence and
+    on the memoised components before them. Their result is computed once per
+    sentence and reused by every branch that runs the same sequence of
+    memoised components. Components without a memo_key must not change the
+    context. Errors are handled as in PipelineProcessor; a failing branch
+    does not affect the other branches.
+    """
+    def __init__(self, shared_components, branches, **options):
+        self.shared_components = shared_components
+        self.branches = branches
+        self.deduplicator = options.get("deduplicator")
+        self.errors = options.get("errors") or dependency.ErrorReport()
+
+    def accept_rows(self, rows):
+        return self.deduplicator is None or self.deduplicator.accept_rows(rows)
+
+    def __call__(self, root_nodes):
+        try:
+            status = self.run_components(self.shared_components, root_nodes, None)
+        except Exception as e:
+            record_pipeline_error(self.errors, root_nodes, e)
+            return True
+        if status == PipelineProcessingStatus.STOP_PROCESSING:
+            return False
+        elif status == PipelineProcessingStatus.DISCARD_NODES:
+            return True
+
+        memo = {}
+        stopped_branches = 0
+        for components in self.branches:
+            try:
+                if self.run_components(components, root_nodes, memo) == PipelineProcessingStatus.STOP_PROCESSING:
+                    stopped_branches += 1
+            except Exception as e:
+                record_pipeline_error(self.errors, root_nodes, e)
+        return stopped_branches < len(self.branches)
+
+    def run_components(self, components, root_nodes, memo):
+        local_context = PipelineContext()
+        memo_prefix = ()
+        for component in components:
+            memo_key = getattr(component, "memo_key", None)
+            if memo is not None and memo_key is not None:
+                memo_prefix += (memo_key,)
+                try:
+                    status, local_context.sentence = memo[memo_prefix]
+                except KeyError:
+                    status = component(root_nodes, local_context)
+                    memo[memo_prefix] = status, local_context.values.get("sentence")
+            else:
+                status = component(root_nodes, local_context)
+
+            if status == PipelineProcessingStatus.STOP_PROCESSING or status == PipelineProcessingStatus.DISCARD_NODES:
+                return status
+            elif status != PipelineProcessingStatus.CONTINUE:
+                raise RuntimeError("Status {0} is invalid", status)
+        return PipelineProcessingStatus.CONTINUE
+
+class SentenceContext(object):
+    """
+    Per-sentence state in batch pipelines. Unlike PipelineContext it has a
+    fixed set of attributes, which makes it smaller and faster to access.
+    """
+    __slots__ = ("root_nodes", "sentence")
+
+    def __init__(self, root_nodes):
+        self.root_nodes = root_nodes
+        self.sentence = None
+
+class PerSentenceAdapter:
+    """
+    Runs a per-sentence pipeline component inside a BatchPipelineProcessor.
+    """
+    def __init__(self, component, errors = None):
+        self.component = component
+        self.errors = errors or dependency.ErrorReport()
+
+    def process_batch(self, contexts):
+        kept = []
+        for context in contexts:
+            try:
+                status = self.component(context.root_nodes, context)
+            except Exception as e:
+                record_pipeline_error(self.errors, context.root_nodes, e)
+                continue
+            if status == PipelineProcessingStatus.CONTINUE:
+                kept.append(context)
+            elif status == PipelineProcessingStatus.STOP_PROCESSING:
+                return PipelineProcessingStatus.STOP_PROCESSING, kept
+            elif status != PipelineProcessingStatus.DISCARD_NODES:
+                raise RuntimeError("Status {0} is invalid", status)
+        return PipelineProcessingStatus.CONTINUE, kept
+
+class BatchPipelineProcessor:
+    """
+    Pipeline that hands whole blocks of sentences to its components.
+
+    Components with a process_batch(contexts) method receive the list of
+    SentenceContexts still alive and return a status together with the
+    contexts that should continue down the pipeline. Returning
+    STOP_PROCESSING ends processing after the returned contexts have passed
+    the rest of the pipeline. All other components are called per sentence
+    through a PerSentenceAdapter. If a batch method fails, the batch is
+    retried sentence by sentence so that only the offending sentences are
+    skipped; batch methods must therefore have no effect (output, counts)
+    unless they succeed for the whole batch. Deduplication and errors work as in PipelineProcessor, except
+    that the offset recorded for a failing sentence is the one of the last
+    sentence of its batch.
+    """
+    def __init__(self, *pipeline_components, **options):
+        self.pipeline_components = pipeline_components
+        self.deduplicator = options.get("deduplicator")
+        self.errors = options.get("errors") or dependency.ErrorReport()
+        self.batch_components = []
+        for component in pipeline_components:
+            if hasattr(component, "process_batch"):
+                self.batch_components.append((component, PerSentenceAdapter(component, self.errors)))
+            else:
+                adapter = PerSentenceAdapter(component, self.errors)
+                self.batch_components.append((adapter, adapter))
+
+    def accept_rows(self, rows):
+        return self.deduplicator is None or self.deduplicator.accept_rows(rows)
+
+    def __call__(self, batch):
+        contexts = [SentenceContext(root_nodes) for root_nodes in batch]
+        should_continue = True
+        for component, fallback in self.batch_components:
+            try:
+                status, contexts = component.process_batch(contexts)
+            except Exception:
+                status, contexts = fallback.process_batch(contexts)
+            if status == PipelineProcessingStatus.STOP_PROCESSING:
+                should_continue = False
+            elif status != PipelineProcessingStatus.CONTINUE:
+                raise RuntimeError("Status {0} is invalid", status)
+            if len(contexts) == 0:
+                break
+        return should_continue
+
 class SentenceTuple:
     def __init__(self, predicate_node, subject_node, object_node, modifiers, pred_trigger, pred_polarity):
         self.predicate_node = predicate_node
@@ -302,13 +544,13 @@ class SentenceTuple:
 
     @property
     def has_unresolved_pronoun(self):
-        if self.subject_node.pos_tag == POS_PPER:
+        if self.subject_node.pos_tag_id == POS_PPER:
             return True
         if self.is_complex_sentence:
             if self.object_node.has_unresolved_pronoun:
                 return True
         else:
-            if self.object_node.pos_tag  == POS_PPER:
+            if self.object_node.pos_tag_id == POS_PPER:
                 return True
 
         return False
@@ -337,19 +579,110 @@ class SentencePolarityWriter:
         self.filename = filename
 
     def __call__(self, root_nodes, local_context):
+        text = self.format_event(local_context.sentence)
         with open(self.filename, "a") as f:
-            if local_context.sentence.predicate_polarity == 1:
-                predicate_polarity_label = "+"
-            else:
-                predicate_polarity_label = "-"
-            f.write("{0}\t{1}\t{2}".format(
-                local_context.sentence.predicate_trigger,
-                predicate_polarity_label,
-                local_context.sentence.object_node.predicate_node.lemma))
-            f.write("\n")
+            f.write(text)
 
         return PipelineProcessingStatus.CONTINUE
 
+    def process_batch(self, contexts):
+        texts = [self.format_event(context.sentence) for context in contexts]
+        with open(self.filename, "a") as f:
+            f.writelines(texts)
+
+        return PipelineProcessingStatus.CONTINUE, contexts
+
+    def format_event(self, sentence):
+        return "{0}\t{1}\t{2}\n".format(*event_record(sentence))
+
+def event_record(sentence):
+    """
+    The (trigger, polarity label, event lemma) observation of a sentence.
+    """
+    if sentence.predicate_polarity == 1:
+        predicate_polarity_label = "+"
+    else:
+        predicate_polarity_label = "-"
+    return sentence.predicate_trigger, predicate_polarity_label, sentence.object_node.predicate_node.lemma
+
+class ColumnarWriter:
+    """
+    Writes what SentenceWriter and SentencePolarityWriter write as column
+    tables (see columnar.py): "sentences" and "tokens" for the candidates,
+    "events" and "modifiers" for the events. Token and modifier rows follow
+    the order of their sentences and events; token_count and
+    modifier_count give the number of rows per sentence and event. Must be
+    closed after processing.
+    """
+    def __init__(self, directory, chunk_size = None, compressed = False):
+        # Imported here, so that runs without column output do not load numpy
+        import columnar
+        if chunk_size is None:
+            chunk_size = columnar.CHUNK_SIZE
+        self.store = columnar.ColumnStoreWriter(directory, chunk_size, compressed)
+        self.sentences = self.store.create_table("sentences", [("sentence_id", "i8"), ("token_count", "i4")])
+        self.tokens = self.store.create_table("tokens", [("token", "i4"), ("word", "i4"), ("lemma", "i4"),
+            ("pos_tag", "i4"), ("head", "i4"), ("label", "i4")])
+        self.events = self.store.create_table("events", [("sentence_id", "i8"), ("trigger", "i4"),
+            ("polarity", "i1"), ("event", "i4"), ("modifier_count", "i4")])
+        self.modifiers = self.store.create_table("modifiers", [("modifier", "i4")])
+        self.sentence_counter = 0
+
+    def __call__(self, root_nodes, local_context):
+        self.write_rows([self.sentence_rows(root_nodes, local_context.sentence)])
+        return PipelineProcessingStatus.CONTINUE
+
+    def process_batch(self, contexts):
+        # All rows are built before any is written, as in SentenceWriter
+        self.write_rows([self.sentence_rows(context.root_nodes, context.sentence) for context in contexts])
+        return PipelineProcessingStatus.CONTINUE, contexts
+
+    def sentence_rows(self, root_nodes, sentence):
+        all_nodes = []
+        for node in root_nodes:
+            all_nodes += node.all_tree_nodes
+        all_nodes.sort(key = lambda n: n.id)
+
+        token_columns = ([node.id for node in all_nodes],
+                [node.word_id for node in all_nodes],
+                [node.lemma_id for node in all_nodes],
+                [node.pos_tag_id for node in all_nodes],
+                [node.parent.id if node.parent else 0 for node in all_nodes],
+                [node.parent_relation_label_id for node in all_nodes])
+        add_string = vocabulary.VOCABULARY.add
+        modifiers = [add_string(modifier) for modifier in sentence.modifiers]
+        event = (add_string(sentence.predicate_trigger), 1 if sentence.predicate_polarity == 1 else -1,
+                sentence.object_node.predicate_node.lemma_id, len(modifiers))
+        return token_columns, modifiers, event
+
+    def write_rows(self, rows):
+        for token_columns, modifiers, event in rows:
+            self.tokens.extend(*token_columns)
+            self.sentences.append(self.sentence_counter, len(token_columns[0]))
+            self.modifiers.extend(modifiers)
+            self.events.append(self.sentence_counter, *event)
+            self.sentence_counter += 1
+
+    def close(self):
+        self.store.close()
+
+class EventTableCollector:
+    """
+    Counts the observations that SentencePolarityWriter writes out.
+    """
+    def __init__(self):
+        self.counter = Counter()
+
+    def __call__(self, root_nodes, local_context):
+        self.counter[event_record(local_context.sentence)] += 1
+        return PipelineProcessingStatus.CONTINUE
+
+    def process_batch(self, contexts):
+        # A list rather than a generator, so that nothing is counted if a
+        # sentence fails
+        self.counter.update([event_record(context.sentence) for context in contexts])
+        return PipelineProcessingStatus.CONTINUE, contexts
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="")
     parser.add_argument("indir")
@@ -357,47 +690,185 @@ if __name__ == "__main__":
     parser.add_argument("--pid", default="")
     parser.add_argument("--start-split", default=0, type = int)
     parser.add_argument("--splitn", default=-1, type = int)
+    parser.add_argument("--collect-entities", action = "store_true",
+            help = "Report the most frequent entities and relations among the candidates")
+    parser.add_argument("--entity-capacity", default = 0, type = int,
+            help = "Track at most this many items per entity statistic (0 counts exactly)")
+    parser.add_argument("--batch-size", default = 0, type = int,
+            help = "Hand blocks of this many sentences to the pipeline (0 processes sentence by sentence)")
+    parser.add_argument("--save-vocabulary", default = None,
+            help = "Write the string table to this file ({0} is replaced by the pid)")
+    parser.add_argument("--dedup-capacity", default = 0, type = int,
+            help = "Skip repeated sentences, expecting up to this many distinct ones (0 disables)")
+    parser.add_argument("--dedup-error-rate", default = 0.001, type = float,
+            help = "False positive rate of the duplicate filter")
+    parser.add_argument("--dedup-file", default = None,
+            help = "Keep the duplicate filter in this file so that parallel processes can share it")
+    parser.add_argument("--sample-rate", default = None, type = float,
+            help = "Only process each sentence with this probability")
+    parser.add_argument("--sample-size", default = None, type = int,
+            help = "Only process a sample of this many sentences")
+    parser.add_argument("--sample-seed", default = 0, type = int)
+    parser.add_argument("--index-dir", default = None,
+            help = "Directory with sentence indexes built by sampling.py")
+    parser.add_argument("--columnar-dir", default = None,
+            help = "Also write candidates and events as column tables to this directory ({0} is replaced by the pid)")
+    parser.add_argument("--compress-columns", action = "store_true",
+            help = "Compress the column chunks, which then cannot be memory-mapped")
+    parser.add_argument("--quarantine", default = None,
+            help = "Append rejected sentences with their file, offset and reason to this file ({0} is replaced by the pid)")
+    parser.add_argument("--max-tokens", default = dependency.MAX_TOKENS_PER_SENTENCE, type = int,
+            help = "Reject sentences with more tokens")
+    parser.add_argument("--max-line-bytes", default = dependency.MAX_LINE_BYTES, type = int,
+            help = "Reject sentences with longer lines")
+    parser.add_argument("--progress-dir", default = None,
+            help = "Write the progress of this process to a status file in this directory")
+    parser.add_argument("--progress-interval", default = None, type = float,
+            help = "Seconds between progress reports (defaults to 1, or 30 without UI)")
     parser.add_argument("--no-ui", dest = 'ui', action = 'store_false')
     parser.set_defaults(ui = True)
     args = parser.parse_args()
+    if args.max_tokens < 1 or args.max_line_bytes < 1:
+        parser.error("--max-tokens and --max-line-bytes must be positive")
 
     process_identifier = args.pid
     start_split = args.start_split
     split_num = args.splitn
 
     if args.ui:
-        count_line = "Processing sentence #"
-        count_update_interval = 1
+        progress_label = ""
+        progress_interval = 1.0
     else:
-        count_update_interval = 1000
-        count_line = "Process {0} at sentence #".format(process_identifier)
+        progress_label = "Process {0}: ".format(process_identifier)
+        progress_interval = 30.0
+    if args.progress_interval is not None:
+        progress_interval = args.progress_interval
 
     sentence_counter = SentenceCounter()
     success_counter = SentenceCounter()
-#    entity_collector = EntityCollector()
-    dependency.process_sdewac_splits(
-            args.indir,
-            PipelineProcessor(
-                sentence_counter,
-                CountIndicator(sentence_counter, count_line, single_line = args.ui, update_interval = count_update_interval),
-                SentenceAnalyser(get_trigger_predicate(args.triggerfile)),
-                SentenceFilter([has_trigger_pred, has_embedding_depth_between(1, 1)]),
-#                entity_collector,
-                success_counter,
-                SentenceWriter("candidates{0}.lmtp".format(process_identifier)),
-                SentencePolarityWriter("events{0}.txt".format(process_identifier))
-                #SentencePrinter()
-                ),
-            start_split = start_split,
-            split_num = split_num
-            )
+    sampling_requested = args.sample_rate is not None or args.sample_size is not None
+
+    quarantine_file = None
+    if args.quarantine:
+        quarantine_file = args.quarantine.format(process_identifier)
+    errors = dependency.ErrorReport(quarantine_file)
+    limits = {"max_tokens": args.max_tokens, "max_line_bytes": args.max_line_bytes}
+    # The entity counts, the column tables and the saved vocabulary refer to
+    # ids of the shared vocabulary; otherwise no string is kept beyond a
+    # bounded vocabulary of the reader
+    if not (args.collect_entities or args.columnar_dir or args.save_vocabulary):
+        limits["vocabulary_size"] = dependency.LOCAL_VOCABULARY_SIZE
+
+    # Created before any output, so that invalid sampling options leave none
+    sampler = None
+    if sampling_requested:
+        try:
+            sampler = sampling.CorpusSampler(rate = args.sample_rate, size = args.sample_size,
+                    seed = args.sample_seed, index_directory = args.index_dir, errors = errors, **limits)
+        except ValueError as e:
+            parser.error(str(e))
+    # Only needed to project the sampled counts to the corpus
+    event_table = EventTableCollector() if sampling_requested else None
+
+    if args.entity_capacity > 0:
+        entity_collector = EntityCollector(functools.partial(SpaceSavingCounter, args.entity_capacity))
+    else:
+        entity_collector = EntityCollector()
+
+    pipeline_components = [
+            sentence_counter,
+            SentenceAnalyser(get_trigger_predicate(args.triggerfile)),
+            SentenceFilter([has_trigger_pred, has_embedding_depth_between(1, 1)])
+            ]
+    if args.collect_entities:
+        pipeline_components.append(entity_collector)
+    pipeline_components.append(success_counter)
+    if event_table is not None:
+        pipeline_components.append(event_table)
+    pipeline_components += [
+            SentenceWriter("candidates{0}.lmtp".format(process_identifier)),
+            SentencePolarityWriter("events{0}.txt".format(process_identifier))
+            #SentencePrinter()
+            ]
+    columnar_writer = None
+    if args.columnar_dir:
+        columnar_writer = ColumnarWriter(args.columnar_dir.format(process_identifier), compressed = args.compress_columns)
+        pipeline_components.append(columnar_writer)
+
+    deduplicator = None
+    if args.dedup_capacity > 0:
+        deduplicator = dedup.DuplicateFilter(dedup.BloomFilter(args.dedup_capacity, args.dedup_error_rate, args.dedup_file))
+
+    if args.batch_size > 0:
+        processor = BatchPipelineProcessor(*pipeline_components, deduplicator = deduplicator, errors = errors)
+    else:
+        processor = PipelineProcessor(*pipeline_components, deduplicator = deduplicator, errors = errors)
+
+    status_file = None
+    if args.progress_dir:
+        if not os.path.isdir(args.progress_dir):
+            os.makedirs(args.progress_dir)
+        status_file = progress.status_file_for(args.progress_dir, process_identifier)
+    split_files = dependency.select_splits(args.indir, start_split, split_num)
+    split_paths = [os.path.join(args.indir, file_) for file_ in split_files]
+
+    if sampler is not None:
+        # Indexed splits are read from their copies in the index directory
+        split_paths = sampler.source_paths(args.indir, split_files)
+    tracker = progress.ProgressTracker(split_paths, sentence_counter, progress_interval, status_file,
+            single_line = args.ui, label = progress_label).start()
+
+    if sampler is not None:
+        sampling.process_sampled_splits(
+                args.indir,
+                processor,
+                sampler,
+                start_split = start_split,
+                split_num = split_num,
+                batch_size = args.batch_size,
+                progress = tracker,
+                **limits
+                )
+    else:
+        dependency.process_sdewac_splits(
+                args.indir,
+                processor,
+                start_split = start_split,
+                split_num = split_num,
+                batch_size = args.batch_size,
+                progress = tracker,
+                **limits
+                )
+    tracker.stop()
+    errors.close()
+    if columnar_writer is not None:
+        columnar_writer.close()
+    if errors.total > 0:
+        print "Process {0}: rejected {1}".format(process_identifier, errors)
+
+    if deduplicator is not None:
+        print "Process {0}: skipped {1}".format(process_identifier, deduplicator)
+
+    if sampler is not None:
+        print "Process {0}: sampled {1} of {2} sentences, skipped {3} compressed blocks".format(
+                process_identifier, sampler.sample_count, sampler.population_count, sampler.skipped_blocks)
+        estimate, margin = sampling.project_count(success_counter.count, sampler.sample_count, sampler.population_count)
+        print "Projected candidates: {0:.0f} +/- {1:.0f}".format(estimate, margin)
+        with open("projected_events{0}.txt".format(process_identifier), "w") as f:
+            for (trigger, polarity, event), count in event_table.counter.most_common():
+                estimate, margin = sampling.project_count(count, sampler.sample_count, sampler.population_count)
+                f.write("{0}\t{1}\t{2}\t{3:.1f}\t{4:.1f}\n".format(trigger, polarity, event, estimate, margin))
 
 #    print "Found {0} candidates out of {1} sentences".format(success_counter.count, sentence_counter.count)
 
-#    print "Best SUBJ entities:"
-#    print entity_collector.subj_position_entities_counter.most_common(25)
-#    print "Best OBJ entities:"
-#    print entity_collector.obj_position_entities_counter.most_common(25)
-#    print "Best relations:"
-#    print entity_collector.relation_counter.most_common(25)
-
+    if args.collect_entities:
+        resolve = vocabulary.VOCABULARY.resolve
+        print "Best SUBJ entities:"
+        print [(resolve(item), count) for item, count in entity_collector.subj_position_entities_counter.most_common(25)]
+        print "Best OBJ entities:"
+        print [(resolve(item), count) for item, count in entity_collector.obj_position_entities_counter.most_common(25)]
+        print "Best relations:"
+        print [(resolve(item), count) for item, count in entity_collector.relation_counter.most_common(25)]
+
+    if args.save_vocabulary:
+        vocabulary.VOCABULARY.save(args.save_vocabulary.format(process_identifier))
@@ -0,0 +1,329 @@
+#!/usr/bin/env python2
+# Continuous extraction: watches a directory for new parsed splits,
+# extracts candidates and events from each of them in a pool of worker
+# processes, adds the events to the running statistics and republishes the
+# PMI ranking (in the format of calculate_chi_squared.py, so that
+# scoring_service.py picks it up).
+#
+#   extraction_daemon.py INDIR TRIGGERFILE OUTDIR
+#
+# Splits should be moved into INDIR once they are complete; files whose
+# name starts with "." or ends with ".tmp" are ignored, and other files are
+# only processed once their size has not changed between two scans. The
+# state in OUTDIR records the processed splits and the event counts, so the
+# daemon can be restarted at any time.
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+from collections import deque
+
+import calculate_chi_squared
+import dependency
+import extract_tuples
+
+STATE_FILE = "state.json"
+METRICS_FILE = "metrics.json"
+RANKING_FILE = "chi_values.txt"
+
+def write_atomically(path, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        write(f)
+    os.rename(tmp_path, path)
+
+def split_name(file_):
+    return file_[:-len(".gz")] if file_.endswith(".gz") else file_
+
+class SplitExtractor:
+    """
+    Extracts the candidates and events of single splits; one instance lives
+    in every worker process.
+    """
+    def __init__(self, trigger_file, output_directory, batch_size):
+        self.get_trigger_predicate = extract_tuples.get_trigger_predicate(trigger_file)
+        self.output_directory = output_directory
+        self.batch_size = batch_size
+
+    def __call__(self, root_directory, file_):
+        name = split_name(file_)
+        candidates_file = os.path.join(self.output_directory, "candidates_{0}.lmtp".format(name))
+        events_file = os.path.join(self.output_directory, "events_{0}.txt".format(name))
+        # Outputs of an interrupted earlier attempt are replaced
+        for path in [candidates_file, events_file]:
+            if os.path.exists(path):
+                os.remove(path)
+
+        sentence_counter = extract_tuples.SentenceCounter()
+        event_table = extract_tuples.EventTableCollector()
+        errors = dependency.ErrorReport()
+        processor_type = extract_tuples.BatchPipelineProcessor if self.batch_size > 0 else extract_tuples.PipelineProcessor
+        processor = processor_type(
+                sentence_counter,
+                extract_tuples.SentenceAnalyser(self.get_trigger_predicate),
+                extract_tuples.SentenceFilter([extract_tuples.has_trigger_pred, extract_tuples.has_embedding_depth_between(1, 1)]),
+                event_table,
+                extract_tuples.SentenceWriter(candidates_file),
+                extract_tuples.SentencePolarityWriter(events_file),
+                errors = errors)
+        dependency.process_sdewac_file(root_directory, file_, processor, self.batch_size,
+                vocabulary_size = dependency.LOCAL_VOCABULARY_SIZE)
+        return sentence_counter.count, event_table.counter.items(), dict(errors.counts)
+
+extractor = None
+
+def init_worker(trigger_file, output_directory, batch_size):
+    global extractor
+    extractor = SplitExtractor(trigger_file, output_directory, batch_size)
+
+def extract_split(root_directory, file_):
+    return extractor(root_directory, file_)
+
+class EventStatistics:
+    """
+    Running event counts, kept as the EventStatistics of
+    calculate_chi_squared.py.
+    """
+    def __init__(self):
+        self.events = {}
+        self.sentence_count = 0
+
+    def add(self, event_counts):
+        for (trigger, polarity, event), count in event_counts:
+            if event not in self.events:
+                self.events[event] = calculate_chi_squared.EventStatistic(event, trigger, "TODO", "TODO")
+            if polarity == "+":
+                self.events[event].positive_count += count
+            else:
+                self.events[event].negative_count += count
+
+    def to_json(self):
+        return [[event.event, event.polarity_source, event.positive_count, event.negative_count]
+                for event in self.events.itervalues()]
+
+    def load_json(self, values):
+        for event, trigger, positive_count, negative_count in values:
+            statistic = calculate_chi_squared.EventStatistic(event, trigger, "TODO", "TODO")
+            statistic.positive_count = positive_count
+            statistic.negative_count = negative_count
+            self.events[event] = statistic
+
+    def write_ranking(self, f):
+        if not self.events:
+            return
+        results = calculate_chi_squared.calculate_chi_squared(self.events)
+        sorted_results = sorted(results.items(), key = lambda r: r[1], reverse = True)
+        for line in calculate_chi_squared.ranking_lines(self.events, sorted_results):
+            f.write(line)
+            f.write("\n")
+
+class LagMetric:
+    """
+    Time between the arrival of a split and the publication of a ranking
+    that includes it.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.last = None
+
+    def add(self, lag):
+        self.count += 1
+        self.total += lag
+        self.maximum = max(self.maximum, lag)
+        self.last = lag
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+class ExtractionDaemon:
+    """
+    Single-threaded scheduler around a process pool. New splits wait in a
+    queue and at most max_in_flight of them are handed to the pool at a
+    time, so a burst of arrivals does not pile up work (and memory) in the
+    pool.
+    """
+    def __init__(self, input_directory, trigger_file, output_directory, workers = None, max_in_flight = None,
+            publish_interval = 10.0, batch_size = 0, tasks_per_worker = 50):
+        self.input_directory = input_directory
+        self.output_directory = output_directory
+        self.publish_interval = publish_interval
+        workers = workers or multiprocessing.cpu_count()
+        self.max_in_flight = max_in_flight or 2 * workers
+        # Workers are replaced after a number of splits since their
+        # vocabulary only ever grows
+        self.pool = multiprocessing.Pool(workers, init_worker, (trigger_file, output_directory, batch_size),
+                maxtasksperchild = tasks_per_worker)
+
+        self.statistics = EventStatistics()
+        self.processed = {}
+        self.failed = {}
+        self.errors = {}
+        # Size and time of first sighting of splits that may still be growing
+        self.sizes = {}
+        self.queue = deque()
+        self.arrivals = {}
+        self.in_flight = {}
+        self.unpublished = []
+        self.last_publish = 0.0
+        self.lag = LagMetric()
+        self.started = time.time()
+        self.load_state()
+
+    def load_state(self):
+        path = os.path.join(self.output_directory, STATE_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            state = json.load(f)
+        self.processed = state["processed"]
+        self.failed = state["failed"]
+        self.errors = state["errors"]
+        self.statistics.sentence_count = state["sentences"]
+        self.statistics.load_json(state["events"])
+        # The previous run may have stopped before publishing its last splits
+        write_atomically(os.path.join(self.output_directory, RANKING_FILE), self.statistics.write_ranking)
+
+    def save_state(self):
+        state = {"processed": self.processed, "failed": self.failed, "errors": self.errors,
+                "sentences": self.statistics.sentence_count, "events": self.statistics.to_json()}
+        write_atomically(os.path.join(self.output_directory, STATE_FILE), lambda f: json.dump(state, f))
+
+    def scan(self):
+        """
+        Queues the splits that have appeared and stopped growing since the
+        last scan.
+        """
+        now = time.time()
+        for file_ in sorted(os.listdir(self.input_directory)):
+            if file_.startswith(".") or file_.endswith(".tmp"):
+                continue
+            if file_ in self.processed or file_ in self.failed or file_ in self.in_flight or file_ in self.arrivals:
+                continue
+            try:
+                size = os.path.getsize(os.path.join(self.input_directory, file_))
+            except OSError:
+                continue
+            last_size, first_seen = self.sizes.get(file_, (None, now))
+            if last_size == size:
+                del self.sizes[file_]
+                self.arrivals[file_] = first_seen
+                self.queue.append(file_)
+            else:
+                self.sizes[file_] = size, first_seen
+
+    def submit(self):
+        while self.queue and len(self.in_flight) < self.max_in_flight:
+            file_ = self.queue.popleft()
+            self.in_flight[file_] = self.pool.apply_async(extract_split, (self.input_directory, file_))
+
+    def collect(self):
+        for file_, result in self.in_flight.items():
+            if not result.ready():
+                continue
+            del self.in_flight[file_]
+            try:
+                sentence_count, event_counts, errors = result.get()
+            except Exception as e:
+                print "Could not process {0} ({1})".format(file_, e)
+                self.failed[file_] = str(e)
+                del self.arrivals[file_]
+                continue
+            self.statistics.sentence_count += sentence_count
+            self.statistics.add(event_counts)
+            self.processed[file_] = sentence_count
+            if errors:
+                self.errors[file_] = errors
+            self.unpublished.append(file_)
+        if self.unpublished:
+            self.save_state()
+
+    def publish(self):
+        """
+        Writes the ranking if splits have been added since the last time,
+        at most every publish_interval seconds unless the daemon is idle.
+        """
+        now = time.time()
+        if not self.unpublished:
+            return
+        if now - self.last_publish < self.publish_interval and (self.in_flight or self.queue):
+            return
+        write_atomically(os.path.join(self.output_directory, RANKING_FILE), self.statistics.write_ranking)
+        published = time.time()
+        for file_ in self.unpublished:
+            self.lag.add(published - self.arrivals.pop(file_))
+        self.unpublished = []
+        self.last_publish = published
+        self.write_metrics()
+        print "{0} splits, {1} sentences, {2} events; lag {3:.1f}s (mean {4:.1f}s, max {5:.1f}s), {6} queued".format(
+                len(self.processed), self.statistics.sentence_count, len(self.statistics.events),
+                self.lag.last, self.lag.mean, self.lag.maximum, len(self.queue) + len(self.in_flight))
+
+    @property
+    def metrics(self):
+        return {"processed_splits": len(self.processed),
+                "failed_splits": len(self.failed),
+                "sentences": self.statistics.sentence_count,
+                "events": len(self.statistics.events),
+                "queued": len(self.queue),
+                "in_flight": len(self.in_flight),
+                "lag_last": self.lag.last,
+                "lag_mean": self.lag.mean,
+                "lag_max": self.lag.maximum,
+                "published": self.last_publish,
+                "uptime": time.time() - self.started}
+
+    def write_metrics(self):
+        metrics = self.metrics
+        write_atomically(os.path.join(self.output_directory, METRICS_FILE), lambda f: json.dump(metrics, f))
+
+    def step(self):
+        self.scan()
+        self.collect()
+        self.submit()
+        self.publish()
+
+    def run(self, poll_interval = 1.0, exit_when_idle = False):
+        try:
+            while True:
+                self.step()
+                if exit_when_idle and not (self.queue or self.in_flight or self.sizes or self.unpublished):
+                    break
+                time.sleep(poll_interval)
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Extracts events from new splits as they arrive and keeps the ranking up to date")
+    parser.add_argument("indir")
+    parser.add_argument("triggerfile")
+    parser.add_argument("outdir")
+    parser.add_argument("--workers", default = None, type = int,
+            help = "Number of worker processes (defaults to the number of cores)")
+    parser.add_argument("--max-in-flight", default = None, type = int,
+            help = "Splits handed to the workers at a time (defaults to twice the number of workers)")
+    parser.add_argument("--poll-interval", default = 1.0, type = float,
+            help = "Seconds between scans of the input directory")
+    parser.add_argument("--publish-interval", default = 10.0, type = float,
+            help = "Minimum seconds between rankings while splits are being processed")
+    parser.add_argument("--batch-size", default = 0, type = int)
+    parser.add_argument("--tasks-per-worker", default = 50, type = int,
+            help = "Replace each worker process after this many splits")
+    parser.add_argument("--exit-when-idle", action = "store_true",
+            help = "Stop once all splits in the directory have been processed")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    daemon = ExtractionDaemon(args.indir, args.triggerfile, args.outdir, args.workers, args.max_in_flight,
+            args.publish_interval, args.batch_size, args.tasks_per_worker)
+    try:
+        daemon.run(args.poll_interval, args.exit_when_idle)
+    except KeyboardInterrupt:
+        pass
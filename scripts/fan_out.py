@@ -0,0 +1,148 @@
+#!/usr/bin/env python2
+# Runs several extraction configurations over the corpus in a single pass.
+# Each sentence is decoded once and handed to one branch per configuration.
+#
+# The configuration is a JSON file such as
+#
+#   {"branches": [
+#       {"name": "depth1", "triggers": "lexicon.txt",
+#        "filters": ["has_trigger_pred", ["has_embedding_depth_between", 1, 1]]},
+#       {"name": "expanded", "triggers": "german_expanded_lexicon.l.txt",
+#        "filters": ["has_trigger_pred", "has_no_unresolved_pronouns"],
+#        "candidates": null}
+#   ]}
+#
+# Filters are given by name, with constructor arguments in a list. Outputs
+# default to candidates_<name><pid>.lmtp and events_<name><pid>.txt; null
+# disables an output.
+
+import argparse
+import json
+import os
+
+import dependency
+import progress
+import extract_tuples
+
+FILTERS = {
+        "is_complex_sentence": extract_tuples.is_complex_sentence,
+        "has_embedding_depth_between": extract_tuples.has_embedding_depth_between,
+        "has_named_entity_subject": extract_tuples.has_named_entity_subject,
+        "has_no_unresolved_pronouns": extract_tuples.has_no_unresolved_pronouns,
+        "has_trigger_pred": extract_tuples.has_trigger_pred,
+        "is_not_reflexive": extract_tuples.is_not_reflexive,
+        "has_unmodified_predicate": extract_tuples.has_unmodified_predicate
+        }
+
+def create_filter(spec):
+    """
+    Creates a SentenceFilter for a single condition. Every condition is its
+    own memoised stage, so branches that start with the same conditions
+    share their results.
+    """
+    if isinstance(spec, basestring):
+        name, arguments = spec, []
+    else:
+        name, arguments = spec[0], spec[1:]
+    if name not in FILTERS:
+        raise ValueError("Unknown filter {0}".format(name))
+
+    condition = FILTERS[name](*arguments) if arguments else FILTERS[name]
+    sentence_filter = extract_tuples.SentenceFilter([condition])
+    sentence_filter.memo_key = ("SentenceFilter", name) + tuple(arguments)
+    return sentence_filter
+
+class Branch:
+    def __init__(self, name, components, counter):
+        self.name = name
+        self.components = components
+        self.counter = counter
+
+def create_branches(config, process_identifier = ""):
+    trigger_predicates = {}
+    branches = []
+    for branch_config in config["branches"]:
+        name = branch_config["name"]
+        trigger_file = os.path.abspath(branch_config["triggers"])
+        if trigger_file not in trigger_predicates:
+            trigger_predicates[trigger_file] = extract_tuples.get_trigger_predicate(trigger_file)
+
+        analyser = extract_tuples.SentenceAnalyser(trigger_predicates[trigger_file])
+        analyser.memo_key = ("SentenceAnalyser", trigger_file)
+        components = [analyser]
+        components += [create_filter(spec) for spec in branch_config.get("filters", [])]
+
+        counter = extract_tuples.SentenceCounter()
+        components.append(counter)
+
+        candidates_file = branch_config.get("candidates", "candidates_{name}{pid}.lmtp")
+        if candidates_file is not None:
+            components.append(extract_tuples.SentenceWriter(candidates_file.format(name = name, pid = process_identifier)))
+        events_file = branch_config.get("events", "events_{name}{pid}.txt")
+        if events_file is not None:
+            components.append(extract_tuples.SentencePolarityWriter(events_file.format(name = name, pid = process_identifier)))
+
+        branches.append(Branch(name, components, counter))
+    return branches
+
+def load_fan_out_config(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Runs several extraction configurations in one pass")
+    parser.add_argument("indir")
+    parser.add_argument("config")
+    parser.add_argument("--pid", default = "")
+    parser.add_argument("--start-split", default = 0, type = int)
+    parser.add_argument("--splitn", default = -1, type = int)
+    parser.add_argument("--quarantine", default = None,
+            help = "Append rejected sentences with their file, offset and reason to this file ({0} is replaced by the pid)")
+    parser.add_argument("--max-tokens", default = dependency.MAX_TOKENS_PER_SENTENCE, type = int,
+            help = "Reject sentences with more tokens")
+    parser.add_argument("--max-line-bytes", default = dependency.MAX_LINE_BYTES, type = int,
+            help = "Reject sentences with longer lines")
+    parser.add_argument("--progress-dir", default = None,
+            help = "Write the progress of this process to a status file in this directory")
+    parser.add_argument("--progress-interval", default = None, type = float,
+            help = "Seconds between progress reports (defaults to 1, or 30 without UI)")
+    parser.add_argument("--no-ui", dest = 'ui', action = 'store_false')
+    parser.set_defaults(ui = True)
+    args = parser.parse_args()
+    if args.max_tokens < 1 or args.max_line_bytes < 1:
+        parser.error("--max-tokens and --max-line-bytes must be positive")
+
+    progress_interval = args.progress_interval or (1.0 if args.ui else 30.0)
+    status_file = None
+    if args.progress_dir:
+        if not os.path.isdir(args.progress_dir):
+            os.makedirs(args.progress_dir)
+        status_file = progress.status_file_for(args.progress_dir, args.pid)
+
+    branches = create_branches(load_fan_out_config(args.config), args.pid)
+    sentence_counter = extract_tuples.SentenceCounter()
+    errors = dependency.ErrorReport(args.quarantine.format(args.pid) if args.quarantine else None)
+    split_paths = [os.path.join(args.indir, file_)
+            for file_ in dependency.select_splits(args.indir, args.start_split, args.splitn)]
+    tracker = progress.ProgressTracker(split_paths, sentence_counter, progress_interval, status_file,
+            single_line = args.ui, label = "" if args.ui else "Process {0}: ".format(args.pid)).start()
+    dependency.process_sdewac_splits(
+            args.indir,
+            extract_tuples.FanOutProcessor(
+                [sentence_counter],
+                [branch.components for branch in branches],
+                errors = errors),
+            start_split = args.start_split,
+            split_num = args.splitn,
+            progress = tracker,
+            max_tokens = args.max_tokens,
+            max_line_bytes = args.max_line_bytes,
+            vocabulary_size = dependency.LOCAL_VOCABULARY_SIZE
+            )
+    tracker.stop()
+    errors.close()
+    if errors.total > 0:
+        print "Rejected {0}".format(errors)
+
+    for branch in branches:
+        print "{0}: {1} candidates out of {2} sentences".format(branch.name, branch.counter.count, sentence_counter.count)
@@ -0,0 +1,133 @@
+import heapq
+import math
+
+class SpaceSavingCounter:
+    """
+    Approximate frequency counter with a fixed memory budget (the
+    Space-Saving algorithm of Metwally et al.). At most `capacity` items
+    are tracked. Reported counts never underestimate the true count and
+    overestimate it by at most `error(item)`, which is bounded by
+    total / capacity. Every item that occurs more often than
+    total / capacity is guaranteed to be tracked.
+    """
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("Capacity must be positive, got {0}".format(capacity))
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        # Min-heap over (count, item) with exactly one entry per tracked item.
+        # Entries are not updated on increments, so they may be stale (too
+        # low); they are refreshed lazily when looking for the minimum.
+        self._heap = []
+
+    @classmethod
+    def for_error_rate(cls, epsilon):
+        """
+        Creates a counter whose overestimation is at most epsilon * total.
+        """
+        return cls(int(math.ceil(1.0 / epsilon)))
+
+    def add(self, item, count = 1):
+        self.total += count
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+            heapq.heappush(self._heap, (count, item))
+        else:
+            min_count, min_item = self._refresh_min()
+            del counts[min_item]
+            del self.errors[min_item]
+            counts[item] = min_count + count
+            self.errors[item] = min_count
+            heapq.heapreplace(self._heap, (min_count + count, item))
+
+    def update(self, iterable):
+        if hasattr(iterable, "iteritems"):
+            for item, count in iterable.iteritems():
+                self.add(item, count)
+        else:
+            for item in iterable:
+                self.add(item)
+
+    def _refresh_min(self):
+        """
+        Moves the item with the smallest count to the top of the heap and
+        returns it.
+        """
+        heap = self._heap
+        counts = self.counts
+        while True:
+            count, item = heap[0]
+            current_count = counts[item]
+            if current_count == count:
+                return count, item
+            heapq.heapreplace(heap, (current_count, item))
+
+    @property
+    def min_count(self):
+        if len(self.counts) < self.capacity:
+            return 0
+        return self._refresh_min()[0]
+
+    @property
+    def max_error(self):
+        """
+        Upper bound on the overestimation of any reported count.
+        """
+        return self.min_count
+
+    def error(self, item):
+        return self.errors.get(item, self.min_count)
+
+    def guaranteed_count(self, item):
+        """
+        Lower bound on the true count of the item.
+        """
+        return self.counts.get(item, 0) - self.errors.get(item, 0)
+
+    def most_common(self, n = None):
+        if n is None:
+            return sorted(self.counts.iteritems(), key = lambda ic: ic[1], reverse = True)
+        return heapq.nlargest(n, self.counts.iteritems(), key = lambda ic: ic[1])
+
+    def merge(self, other):
+        """
+        Combines two summaries (e.g. from parallel workers) into a new one
+        with the capacity of this summary. Items missing from one summary are
+        assumed to have occurred as often as its minimum count there, which
+        keeps all counts upper bounds of the true counts.
+        """
+        self_min = self.min_count
+        other_min = other.min_count
+
+        merged_counts = {}
+        merged_errors = {}
+        for item in set(self.counts) | set(other.counts):
+            merged_counts[item] = self.counts.get(item, self_min) + other.counts.get(item, other_min)
+            merged_errors[item] = self.errors.get(item, self_min) + other.errors.get(item, other_min)
+
+        result = SpaceSavingCounter(self.capacity)
+        result.total = self.total + other.total
+        for item, count in heapq.nlargest(self.capacity, merged_counts.iteritems(), key = lambda ic: ic[1]):
+            result.counts[item] = count
+            result.errors[item] = merged_errors[item]
+            result._heap.append((count, item))
+        heapq.heapify(result._heap)
+        return result
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    def __getitem__(self, item):
+        return self.counts.get(item, 0)
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def __len__(self):
+        return len(self.counts)
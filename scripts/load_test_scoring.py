@@ -0,0 +1,116 @@
+#!/usr/bin/env python2
+# Load test for scoring_service.py. Sends CoNLL sentences from a corpus file
+# from several threads and reports latency percentiles and throughput.
+
+import argparse
+import gzip
+import httplib
+import json
+import socket
+import threading
+import time
+
+class TCPHTTPConnection(httplib.HTTPConnection):
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_path)
+
+def read_conll_sentences(filename, limit):
+    open_ = gzip.open if filename.endswith(".gz") else open
+    sentences = []
+    current = []
+    with open_(filename, "rb") as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                if current:
+                    sentences.append("".join(current))
+                    current = []
+                    if len(sentences) >= limit:
+                        break
+            else:
+                current.append(line)
+    if current and len(sentences) < limit:
+        sentences.append("".join(current))
+    return sentences
+
+def percentile(sorted_values, fraction):
+    idx = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[idx]
+
+class LoadWorker(threading.Thread):
+    def __init__(self, connect, bodies):
+        super(LoadWorker, self).__init__()
+        self.connect = connect
+        self.bodies = bodies
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        connection = self.connect()
+        for body in self.bodies:
+            start = time.time()
+            try:
+                connection.request("POST", "/score", body, {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    self.errors += 1
+            except (socket.error, httplib.HTTPException):
+                self.errors += 1
+                connection.close()
+                connection = self.connect()
+                continue
+            self.latencies.append(time.time() - start)
+        connection.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the scoring service")
+    parser.add_argument("conll_file", help = "CoNLL file (optionally gzipped) to take sentences from")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", default = 8411, type = int)
+    parser.add_argument("--unix-socket", default = None)
+    parser.add_argument("--requests", default = 10000, type = int)
+    parser.add_argument("--concurrency", default = 8, type = int)
+    parser.add_argument("--batch-size", default = 1, type = int,
+            help = "Sentences sent per request")
+    parser.add_argument("--distinct-sentences", default = 5000, type = int,
+            help = "Number of different sentences to cycle through")
+    args = parser.parse_args()
+
+    sentences = read_conll_sentences(args.conll_file, args.distinct_sentences)
+    bodies = []
+    for idx in range(args.requests):
+        start = idx * args.batch_size
+        batch = [sentences[(start + offset) % len(sentences)] for offset in range(args.batch_size)]
+        bodies.append(json.dumps({"conll": batch}))
+
+    if args.unix_socket:
+        connect = lambda: UnixHTTPConnection(args.unix_socket)
+    else:
+        connect = lambda: TCPHTTPConnection(args.host, args.port)
+
+    workers = [LoadWorker(connect, bodies[idx::args.concurrency]) for idx in range(args.concurrency)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    latencies = sorted(latency for worker in workers for latency in worker.latencies)
+    errors = sum(worker.errors for worker in workers)
+    if not latencies:
+        print "No successful requests ({0} errors)".format(errors)
+    else:
+        print "{0} requests ({1} sentences each) in {2:.2f}s, {3} errors".format(len(latencies), args.batch_size, elapsed, errors)
+        print "requests/sec: {0:.1f}, sentences/sec: {1:.1f}".format(len(latencies) / elapsed, len(latencies) * args.batch_size / elapsed)
+        print "latency p50: {0:.2f}ms, p99: {1:.2f}ms".format(percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000)
@@ -4,11 +4,14 @@ import math
 import time
 import os
 
-def start_processes_on_files(scriptpath, indir, triggerfile, files, files_per_process = 5):
+import progress
+
+def start_processes_on_files(scriptpath, indir, triggerfile, files, files_per_process = 5, progress_dir = None,
+        progress_interval = None):
     total_process_num = int(math.ceil(len(files) / float(files_per_process)))
     processes = {}
     for p_num in range(0, total_process_num):
-        process = Popen([
+        arguments = [
             scriptpath,
             indir,
             triggerfile,
@@ -18,13 +21,18 @@ def start_processes_on_files(scriptpath, indir, triggerfile, files, files_per_pr
             str(files_per_process),
             "--pid",
             str(p_num),
-            "--no-ui"])
-        processes[p_num] = process
+            "--no-ui"]
+        if progress_dir is not None:
+            arguments += ["--progress-dir", progress_dir]
+        if progress_interval is not None:
+            arguments += ["--progress-interval", str(progress_interval)]
+        processes[p_num] = Popen(arguments)
 
     return processes
 
-def wait_for_processes(processes):
+def wait_for_processes(processes, progress_dir = None, report_interval = 30.0):
     original_process_count = len(processes)
+    last_report = time.time()
     while len(processes) > 0:
         to_remove = []
         for pid, process in processes.items():
@@ -37,6 +45,9 @@ def wait_for_processes(processes):
         for pid in to_remove:
             print "Process {0} finished".format(pid)
             del processes[pid]
+        if progress_dir is not None and time.time() - last_report >= report_interval:
+            last_report = time.time()
+            print progress.format_summary(progress.summarise(progress.read_statuses(progress_dir)))
         time.sleep(0.5)
 
 def collect_files(original_process_count):
@@ -57,15 +68,26 @@ if __name__ == "__main__":
     parser.add_argument("scriptpath")
     parser.add_argument("indir")
     parser.add_argument("triggerfile")
-    parser.add_argument("--collect", target = "collect_only", action = "store_true")
-    parser.defaults(collect_only = False)
+    parser.add_argument("--collect", dest = "collect_only", action = "store_true")
+    parser.set_defaults(collect_only = False)
+    parser.add_argument("--progress-dir", default = "progress",
+            help = "Directory for the status files of the processes")
+    parser.add_argument("--report-interval", default = 30.0, type = float,
+            help = "Seconds between reports of the combined progress")
 
     args = parser.parse_args()
 
     if not args.collect_only:
-        processes = start_processes_on_files(args.scriptpath, args.indir, args.triggerfile, os.listdir(args.indir))
+        if not os.path.isdir(args.progress_dir):
+            os.makedirs(args.progress_dir)
+        # Statuses of an earlier run would distort the combined progress
+        for file_ in os.listdir(args.progress_dir):
+            if progress.is_status_file(file_):
+                os.remove(os.path.join(args.progress_dir, file_))
+        processes = start_processes_on_files(args.scriptpath, args.indir, args.triggerfile, os.listdir(args.indir),
+                progress_dir = args.progress_dir, progress_interval = args.report_interval)
         original_process_count = len(processes)
-        wait_for_processes(processes)
+        wait_for_processes(processes, args.progress_dir, args.report_interval)
     collect_files(original_process_count)
 
     print "Done"
@@ -0,0 +1,290 @@
+#!/usr/bin/env python2
+# Content-addressed cache of dependency parses, so that sentences are only
+# given to the parser once, however often the sentence selection (e.g. of
+# detect_sentences.py) changes.
+#
+#   parse_cache.py parse SENTENCES OUTPUT --cache-dir parse_cache
+#   parse_cache.py stats --cache-dir parse_cache
+#
+# SENTENCES has one sentence per line. Parses are keyed by a hash of the
+# normalised sentence and the parser model, and stored compressed in a
+# single data file with a fixed-size index entry per parse. When the data
+# file grows beyond its limit, the least recently used parses are dropped.
+# A cache directory must not be used by several processes at once.
+
+import argparse
+import hashlib
+import os
+import struct
+import tempfile
+import time
+import unicodedata
+import zlib
+
+import extract_tuples
+
+DATA_FILE = "parses.dat"
+INDEX_FILE = "index.dat"
+# Key, data offset, data length, last use, parse seconds
+INDEX_ENTRY = struct.Struct("<20sQIIf")
+DEFAULT_MAX_BYTES = 1 << 30
+# Share of the limit kept when parses are evicted, so that eviction does not
+# happen again right away
+EVICTION_TARGET = 0.8
+
+def normalise_sentence(text):
+    """
+    Unicode NFC with whitespace collapsed, so that sentences which differ
+    only in their encoding or spacing share a parse.
+    """
+    text = text.decode("utf-8", "replace") if isinstance(text, str) else text
+    return u" ".join(unicodedata.normalize("NFC", text).split()).encode("utf-8")
+
+def cache_key(text, model):
+    return hashlib.sha1(model + "\0" + normalise_sentence(text)).digest()
+
+def read_conll_blocks(lines):
+    """
+    Yields the rows of each sentence of CoNLL output as lists of lines.
+    """
+    rows = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.strip():
+            rows.append(line)
+        elif rows:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+def renumber(rows, sentence_number):
+    """
+    Sets the sentence number of ids of the form SENTENCE_TOKEN (as in the
+    sdewac splits), which depends on the position in the output.
+    """
+    renumbered = []
+    for row in rows:
+        id_, separator, rest = row.partition("\t")
+        sentence, underscore, token = id_.partition("_")
+        if underscore:
+            id_ = "{0}_{1}".format(sentence_number, token)
+        renumbered.append(id_ + separator + rest)
+    return renumbered
+
+class ParseCache:
+    """
+    On-disk map from cache keys to the rows of a parse. The index is kept in
+    memory and written back by save() or close(); parses added since the
+    last save are lost if the process is killed, but the cache stays
+    consistent.
+    """
+    def __init__(self, directory, max_bytes = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Key -> [offset, length, last use, parse seconds]
+        self.entries = {}
+        # Per sentence given to parse_sentences
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.seconds_saved = 0.0
+        self.parser_seconds = 0.0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        data_path = os.path.join(directory, DATA_FILE)
+        self.data = open(data_path, "a+b")
+        self.data_size = os.path.getsize(data_path)
+        self.load_index()
+
+    def load_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            content = f.read()
+        for position in xrange(0, len(content) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            key, offset, length, last_use, seconds = INDEX_ENTRY.unpack_from(content, position)
+            # The data file may have been truncated or replaced
+            if offset + length <= self.data_size:
+                self.entries[key] = [offset, length, last_use, seconds]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        The rows of the cached parse and the seconds it took to parse, or
+        None.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        offset, length, _, seconds = entry
+        self.data.seek(offset)
+        rows = zlib.decompress(self.data.read(length)).split("\n")
+        entry[2] = int(time.time())
+        return rows, seconds
+
+    def put(self, key, rows, seconds = 0.0):
+        data = zlib.compress("\n".join(rows))
+        self.data.seek(0, os.SEEK_END)
+        self.data.write(data)
+        self.entries[key] = [self.data_size, len(data), int(time.time()), seconds]
+        self.data_size += len(data)
+        if self.data_size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Rewrites the data file with the most recently used parses that fit
+        into EVICTION_TARGET of the limit.
+        """
+        budget = int(self.max_bytes * EVICTION_TARGET)
+        kept = {}
+        tmp_path = os.path.join(self.directory, DATA_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            size = 0
+            for key, entry in sorted(self.entries.iteritems(), key = lambda item: item[1][2], reverse = True):
+                offset, length, last_use, seconds = entry
+                if size + length > budget:
+                    break
+                self.data.seek(offset)
+                f.write(self.data.read(length))
+                kept[key] = [size, length, last_use, seconds]
+                size += length
+        self.data.close()
+        os.rename(tmp_path, os.path.join(self.directory, DATA_FILE))
+        self.data = open(os.path.join(self.directory, DATA_FILE), "a+b")
+        self.evicted += len(self.entries) - len(kept)
+        self.entries = kept
+        self.data_size = size
+        # The old index refers to the old data file
+        self.save()
+
+    def save(self):
+        self.data.flush()
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + ".tmp", "wb") as f:
+            for key, (offset, length, last_use, seconds) in self.entries.iteritems():
+                f.write(INDEX_ENTRY.pack(key, offset, length, last_use, seconds))
+        os.rename(path + ".tmp", path)
+
+    def close(self):
+        self.save()
+        self.data.close()
+
+    @property
+    def hit_rate(self):
+        return self.hits / float(max(self.hits + self.misses, 1))
+
+    def __str__(self):
+        return "{0} of {1} sentences from the cache ({2:.1%}), {3} parsed in {4:.1f}s, saved about {5:.1f}s of parsing".format(
+                self.hits, self.hits + self.misses, self.hit_rate, self.misses, self.parser_seconds, self.seconds_saved)
+
+def parse_sentences(sentences, cache, parse, model = extract_tuples.HDPRO_MODEL):
+    """
+    Returns the parses (lists of CoNLL rows) of the sentences in their
+    order. Only the sentences that are not in the cache are passed to
+    parse, once each, which has to return their parses in order.
+    """
+    keys = [cache_key(sentence, model) for sentence in sentences]
+    # Key -> (rows, parse seconds)
+    parses = {}
+    missing = []
+    for sentence, key in zip(sentences, keys):
+        if key not in parses:
+            parses[key] = cache.get(key)
+            if parses[key] is None:
+                missing.append((key, sentence))
+
+    if missing:
+        start = time.time()
+        fresh_parses = parse([sentence for _, sentence in missing])
+        elapsed = time.time() - start
+        if len(fresh_parses) != len(missing):
+            raise ValueError("The parser returned {0} parses for {1} sentences".format(len(fresh_parses), len(missing)))
+        cache.parser_seconds += elapsed
+        seconds = elapsed / len(missing)
+        for (key, _), rows in zip(missing, fresh_parses):
+            parses[key] = rows, seconds
+            cache.put(key, rows, seconds)
+
+    # Repetitions of a sentence parsed in this run count as hits as well
+    unparsed = set(key for key, _ in missing)
+    for key in keys:
+        if key in unparsed:
+            unparsed.remove(key)
+            cache.misses += 1
+        else:
+            cache.hits += 1
+            cache.seconds_saved += parses[key][1]
+    return [parses[key][0] for key in keys]
+
+class HdproParser:
+    """
+    Parses sentences with extract_tuples.run_hdpro, one sentence per line
+    of its input.
+    """
+    def __init__(self, model = extract_tuples.HDPRO_MODEL):
+        self.model = model
+
+    def __call__(self, sentences):
+        input_file = tempfile.NamedTemporaryFile(suffix = ".txt", delete = False)
+        output_file = tempfile.TemporaryFile()
+        try:
+            with input_file:
+                for sentence in sentences:
+                    input_file.write(normalise_sentence(sentence))
+                    input_file.write("\n")
+            exit_code = extract_tuples.run_hdpro(input_file.name, self.model, output_file)
+            if exit_code != 0:
+                raise RuntimeError("The parser exited with code {0}".format(exit_code))
+            output_file.seek(0)
+            return list(read_conll_blocks(output_file))
+        finally:
+            output_file.close()
+            os.remove(input_file.name)
+
+def parse_file(input_path, output_path, cache, model = extract_tuples.HDPRO_MODEL, parse = None):
+    """
+    Writes the parses of the sentences in a file, one per line, to a CoNLL
+    file, numbering the sentences from 1. Blank lines are skipped.
+    """
+    with open(input_path) as f:
+        sentences = [line.strip() for line in f if line.strip()]
+    parses = parse_sentences(sentences, cache, parse or HdproParser(model), model)
+    with open(output_path, "w") as f:
+        for sentence_number, rows in enumerate(parses, 1):
+            for row in renumber(rows, sentence_number):
+                f.write(row)
+                f.write("\n")
+            f.write("\n")
+    return len(sentences)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Parses sentences, taking the parses of sentences parsed before from a cache")
+    parser.add_argument("--cache-dir", default = "parse_cache")
+    parser.add_argument("--max-size", default = DEFAULT_MAX_BYTES >> 20, type = int,
+            help = "Megabytes of parses to keep; the least recently used ones are dropped beyond that")
+    subparsers = parser.add_subparsers(dest = "command")
+    parse_parser = subparsers.add_parser("parse", help = "Parse a file with one sentence per line into a CoNLL 2009 file")
+    parse_parser.add_argument("sentences")
+    parse_parser.add_argument("output")
+    parse_parser.add_argument("--model", default = extract_tuples.HDPRO_MODEL,
+            help = "Parser model (-mv), which is part of the cache key")
+    subparsers.add_parser("stats", help = "Show the size of the cache")
+    args = parser.parse_args()
+
+    cache = ParseCache(args.cache_dir, args.max_size << 20)
+    try:
+        if args.command == "parse":
+            parse_file(args.sentences, args.output, cache, args.model)
+            print cache
+            if cache.evicted:
+                print "Evicted {0} parses".format(cache.evicted)
+        else:
+            print "{0} parses, {1:.1f}MB of {2}MB".format(len(cache), cache.data_size / float(1 << 20), args.max_size)
+    finally:
+        cache.close()
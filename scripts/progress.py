@@ -0,0 +1,224 @@
+#!/usr/bin/env python2
+# Progress reporting for long extraction runs. A ProgressTracker measures
+# progress as the compressed bytes read from the splits against their total
+# size. It is driven by a timer thread that samples the position in the
+# current split, so the pipeline itself does no work per sentence.
+#
+# Every process can write its status to a file in a shared directory;
+# "progress.py STATUS_DIR" (or parallel_extract.py) combines them into the
+# overall progress, rate and ETA and points out workers that have stalled.
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+STALL_SECONDS = 300.0
+STATUS_PREFIX = "progress"
+STATUS_SUFFIX = ".json"
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return "{0}d {1}:{2:02d}:{3:02d}".format(days, hours, minutes, seconds)
+    return "{0}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
+
+def format_bytes(count):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if count < 1024:
+            return "{0:.1f}{1}".format(count, unit)
+        count /= 1024.0
+    return "{0:.1f}TB".format(count)
+
+def write_atomically(path, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        write(f)
+    os.rename(tmp_path, path)
+
+class ProgressTracker:
+    """
+    Tracks the progress through a list of split files. process_sdewac_splits
+    announces every file it opens with start_file and finish_file; the timer
+    thread samples the position of the open file every `interval` seconds,
+    prints a report and, given a status_file, writes the status there. The
+    sentence count is read from an optional SentenceCounter.
+    """
+    def __init__(self, file_paths, sentence_counter = None, interval = 1.0, status_file = None,
+            output = sys.stdout, single_line = True, label = ""):
+        self.bytes_total = sum(os.path.getsize(path) for path in file_paths)
+        self.file_count = len(file_paths)
+        self.sentence_counter = sentence_counter
+        self.interval = interval
+        self.status_file = status_file
+        self.output = output
+        self.single_line = single_line
+        self.label = label
+
+        self.files_done = 0
+        self.bytes_done = 0
+        self.current_file = None
+        self.current_name = None
+        self.current_size = 0
+        self.started = None
+        self.advanced = None
+        self.last_position = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.started = self.advanced = time.time()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.report(finished = True)
+
+    def start_file(self, name, raw_file):
+        self.current_size = os.fstat(raw_file.fileno()).st_size
+        self.current_name = name
+        self.current_file = raw_file
+
+    def finish_file(self, name):
+        # A file counts as read even if it could not be read to the end
+        self.bytes_done += self.current_size
+        self.files_done += 1
+        self.current_file = None
+        self.current_name = None
+
+    @property
+    def sentence_count(self):
+        return self.sentence_counter.count if self.sentence_counter is not None else 0
+
+    def bytes_read(self):
+        raw_file = self.current_file
+        position = 0
+        if raw_file is not None:
+            try:
+                position = raw_file.tell()
+            except (ValueError, IOError):
+                pass
+        return min(self.bytes_done + position, self.bytes_total)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def status(self, finished = False):
+        now = time.time()
+        bytes_read = self.bytes_total if finished else self.bytes_read()
+        position = (bytes_read, self.sentence_count)
+        if position != self.last_position:
+            self.last_position = position
+            self.advanced = now
+        return {"label": self.label,
+                "pid": os.getpid(),
+                "bytes_total": self.bytes_total,
+                "bytes_read": bytes_read,
+                "files_total": self.file_count,
+                "files_done": self.files_done,
+                "current_file": self.current_name,
+                "sentences": self.sentence_count,
+                "started": self.started,
+                "advanced": self.advanced,
+                "updated": now,
+                "finished": finished}
+
+    def report(self, finished = False):
+        status = self.status(finished)
+        if self.status_file is not None:
+            write_atomically(self.status_file, lambda f: json.dump(status, f))
+        if self.output is not None:
+            summary = summarise([status])
+            self.output.write(self.label + format_summary(summary))
+            self.output.write("\r" if self.single_line and not finished else "\n")
+            self.output.flush()
+
+def summarise(statuses, stall_seconds = STALL_SECONDS, now = None):
+    """
+    Combines the statuses of several processes. The rate is the sum of the
+    average rates of the unfinished processes, or the overall average once
+    all of them have finished.
+    """
+    now = now or time.time()
+    summary = {"bytes_total": 0, "bytes_read": 0, "files_total": 0, "files_done": 0, "sentences": 0,
+            "byte_rate": 0.0, "sentence_rate": 0.0, "workers": len(statuses), "running": 0, "stalled": []}
+    for status in statuses:
+        for key in ["bytes_total", "bytes_read", "files_total", "files_done", "sentences"]:
+            summary[key] += status[key]
+        if status["finished"]:
+            continue
+        summary["running"] += 1
+        elapsed = max(now - status["started"], 1e-3)
+        summary["byte_rate"] += status["bytes_read"] / elapsed
+        summary["sentence_rate"] += status["sentences"] / elapsed
+        idle = now - min(status["advanced"], status["updated"])
+        if idle > stall_seconds:
+            summary["stalled"].append((status["label"] or status["pid"], status["current_file"], idle))
+
+    remaining = summary["bytes_total"] - summary["bytes_read"]
+    summary["eta"] = remaining / summary["byte_rate"] if summary["byte_rate"] > 0 else None
+    if statuses and summary["running"] == 0:
+        # Average over the whole run once all processes have finished
+        elapsed = max(max(status["updated"] for status in statuses) - min(status["started"] for status in statuses), 1e-3)
+        summary["byte_rate"] = summary["bytes_read"] / elapsed
+        summary["sentence_rate"] = summary["sentences"] / elapsed
+        summary["eta"] = 0
+    return summary
+
+def format_summary(summary):
+    fraction = summary["bytes_read"] / float(max(summary["bytes_total"], 1))
+    line = "{0:.1%} of {1} ({2}/{3} files), {4}/s, {5:.0f} sentences/s, {6} sentences, ETA {7}".format(
+            fraction, format_bytes(summary["bytes_total"]), summary["files_done"], summary["files_total"],
+            format_bytes(summary["byte_rate"]), summary["sentence_rate"], summary["sentences"],
+            format_duration(summary["eta"]))
+    if summary["workers"] > 1:
+        line += ", {0} of {1} workers running".format(summary["running"], summary["workers"])
+    for worker, file_, idle in summary["stalled"]:
+        line += "; {0} stalled on {1} for {2}".format(worker, file_, format_duration(idle))
+    return line
+
+def read_statuses(directory):
+    statuses = []
+    for file_ in sorted(os.listdir(directory)):
+        if not is_status_file(file_):
+            continue
+        try:
+            with open(os.path.join(directory, file_)) as f:
+                statuses.append(json.load(f))
+        except (IOError, ValueError):
+            # Written while we read it; the next report will include it
+            pass
+    return statuses
+
+def status_file_for(directory, process_identifier):
+    return os.path.join(directory, "{0}{1}{2}".format(STATUS_PREFIX, process_identifier, STATUS_SUFFIX))
+
+def is_status_file(file_):
+    return file_.startswith(STATUS_PREFIX) and file_.endswith(STATUS_SUFFIX)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Shows the combined progress of the processes reporting to a directory")
+    parser.add_argument("status_dir")
+    parser.add_argument("--interval", default = 5.0, type = float)
+    parser.add_argument("--stall-seconds", default = STALL_SECONDS, type = float,
+            help = "Report workers that have not advanced for this long")
+    args = parser.parse_args()
+
+    while True:
+        statuses = read_statuses(args.status_dir)
+        summary = summarise(statuses, args.stall_seconds)
+        print format_summary(summary)
+        if statuses and summary["running"] == 0:
+            break
+        time.sleep(args.interval)
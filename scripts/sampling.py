@@ -0,0 +1,398 @@
+#!/usr/bin/env python2
+# Reproducible sentence samples across all sdewac splits, for fast iteration
+# on the extraction pipeline, and projection of sample counts to the corpus.
+#
+# Splits can be indexed with "sampling.py INDIR INDEX_DIR", which writes a
+# copy of each split to INDEX_DIR as a series of small gzip members (still
+# readable by gzip.open) and records the offset, length and sentence count
+# of each member. Samples from indexed splits only decompress the blocks
+# that contain sampled sentences. With --in-place the splits in INDIR are
+# replaced by their re-blocked copies instead, which saves the disk space.
+
+import argparse
+import contextlib
+import gzip
+import io
+import math
+import os
+import random
+import struct
+import zlib
+
+from cStringIO import StringIO
+
+import dependency
+
+INDEX_SUFFIX = ".sidx"
+BLOCK_ENTRY = struct.Struct("<QII")
+
+def iter_sentence_texts(instream, source = "", errors = None, **limits):
+    """
+    Yields the lines of each sentence of a CoNLL stream as one string.
+    Sentences beyond the limits of dependency.ConllReader are reported to
+    the ErrorReport and skipped without being read into memory.
+    """
+    reader = dependency.ConllReader(instream, source, errors, **limits)
+    while True:
+        lines = reader.read_rows(split_lines = False)
+        if lines is None:
+            return
+        yield "".join(lines)
+
+@contextlib.contextmanager
+def open_tracked(path, name, progress = None):
+    """
+    Opens a file and announces it to a progress.ProgressTracker, as
+    dependency.process_sdewac_file does.
+    """
+    with open(path, "rb") as raw_file:
+        if progress is not None:
+            progress.start_file(name, raw_file)
+        try:
+            yield raw_file
+        finally:
+            if progress is not None:
+                progress.finish_file(name)
+
+def open_split(raw_file):
+    # BufferedReader makes reading lines of bounded length much faster
+    return io.BufferedReader(gzip.GzipFile(fileobj = raw_file, mode = "rb"), dependency.READ_BUFFER_SIZE)
+
+def gzip_member(data):
+    buf = StringIO()
+    with gzip.GzipFile(fileobj = buf, mode = "wb") as f:
+        f.write(data)
+    return buf.getvalue()
+
+def index_path_for(index_directory, file_):
+    return os.path.join(index_directory, file_ + INDEX_SUFFIX)
+
+def blocked_path_for(index_directory, file_):
+    return os.path.join(index_directory, file_)
+
+def build_sentence_index(split_path, index_path, blocked_path, sentences_per_block = 32, errors = None, **limits):
+    """
+    Writes the content of a split to blocked_path as one gzip member per
+    block of sentences, and the block index to index_path. Both are
+    replaced by renaming, so blocked_path may be the split itself.
+    Sentences beyond the limits are reported to `errors` and left out of
+    the copy; since they would be lost, a split with such sentences is not
+    replaced but raises a ValueError.
+    """
+    errors = errors if errors is not None else dependency.ErrorReport()
+    rejected = errors.total
+    # Next to the target, so that the rename is atomic
+    tmp_path = blocked_path + ".tmp"
+    entries = []
+    with open(split_path, "rb") as raw_file, open_split(raw_file) as f, open(tmp_path, "wb") as out:
+        block = []
+        for sentence in iter_sentence_texts(f, os.path.basename(split_path), errors, **limits):
+            block.append(sentence + "\n")
+            if len(block) == sentences_per_block:
+                entries.append(write_block(out, block))
+                block = []
+        if block:
+            entries.append(write_block(out, block))
+
+    if blocked_path == split_path and errors.total > rejected:
+        os.remove(tmp_path)
+        raise ValueError("{0} has rejected sentences and is not replaced".format(split_path))
+    os.rename(tmp_path, blocked_path)
+    with open(index_path + ".tmp", "wb") as f:
+        for entry in entries:
+            f.write(BLOCK_ENTRY.pack(*entry))
+    os.rename(index_path + ".tmp", index_path)
+
+def write_block(out, sentences):
+    compressed = gzip_member("".join(sentences))
+    offset = out.tell()
+    out.write(compressed)
+    return offset, len(compressed), len(sentences)
+
+class SentenceIndex:
+    def __init__(self, blocks, data_path):
+        # (compressed offset, compressed length, sentence count) per block
+        self.blocks = blocks
+        self.data_path = data_path
+        self.sentence_count = sum(block[2] for block in blocks)
+        self.blocks_read = 0
+
+    @classmethod
+    def load(cls, index_path, data_path):
+        blocks = []
+        with open(index_path, "rb") as f:
+            data = f.read()
+        for pos in range(0, len(data), BLOCK_ENTRY.size):
+            blocks.append(BLOCK_ENTRY.unpack_from(data, pos))
+        return cls(blocks, data_path)
+
+    @property
+    def data_size(self):
+        if not self.blocks:
+            return 0
+        offset, length, _ = self.blocks[-1]
+        return offset + length
+
+    def read_sentences(self, positions, progress = None):
+        """
+        Yields the sentences at the given sorted positions, decompressing
+        only the blocks that contain one of them.
+        """
+        positions = iter(positions)
+        position = next(positions, None)
+        first_in_block = 0
+        with open_tracked(self.data_path, os.path.basename(self.data_path), progress) as f:
+            for offset, length, sentence_count in self.blocks:
+                if position is None:
+                    break
+                if position < first_in_block + sentence_count:
+                    self.blocks_read += 1
+                    f.seek(offset)
+                    sentences = list(iter_sentence_texts(StringIO(zlib.decompress(f.read(length), 16 + zlib.MAX_WBITS))))
+                    while position is not None and position < first_in_block + sentence_count:
+                        yield sentences[position - first_in_block]
+                        position = next(positions, None)
+                first_in_block += sentence_count
+
+def load_sentence_index(index_directory, root_directory, file_):
+    """
+    Returns the index of a split, or None if there is none or the split has
+    changed since it was indexed. The blocks are read from the copy in the
+    index directory, or from the split itself if it was indexed in place.
+    """
+    if index_directory is None:
+        return None
+    index_path = index_path_for(index_directory, file_)
+    split_path = os.path.join(root_directory, file_)
+    if not os.path.exists(index_path):
+        return None
+    if os.path.getmtime(index_path) < os.path.getmtime(split_path):
+        return None
+    data_path = blocked_path_for(index_directory, file_)
+    if not os.path.exists(data_path):
+        data_path = split_path
+    index = SentenceIndex.load(index_path, data_path)
+    # Offsets into any other file would decode garbage
+    if index.data_size != os.path.getsize(data_path):
+        return None
+    return index
+
+class CorpusSampler:
+    """
+    Draws a seeded sample of sentences spread over all given splits, either
+    each sentence independently with probability `rate` (Bernoulli) or a
+    fixed number `size` of sentences. Fixed-size samples are allocated to
+    the splits in proportion to their size when all of them are indexed and
+    are drawn by reservoir sampling otherwise.
+
+    After the sample has been consumed, population_count holds the number
+    of sentences in the sampled splits and sample_count the number of
+    sampled sentences. Splits that cannot be read and sentences beyond the
+    limits of dependency.ConllReader are counted in the `errors` report;
+    rejected sentences are not part of the population.
+    """
+    def __init__(self, rate = None, size = None, seed = 0, index_directory = None, errors = None, **limits):
+        if (rate is None) == (size is None):
+            raise ValueError("Exactly one of rate and size must be given")
+        if rate is not None and not 0 < rate <= 1:
+            raise ValueError("The sample rate must be in (0, 1], not {0}".format(rate))
+        if size is not None and size < 1:
+            raise ValueError("The sample size must be positive, not {0}".format(size))
+        self.rate = rate
+        self.size = size
+        self.rng = random.Random(seed)
+        self.index_directory = index_directory
+        self.population_count = 0
+        self.sample_count = 0
+        self.skipped_blocks = 0
+        self.errors = errors or dependency.ErrorReport()
+        self.limits = limits
+        self.progress = None
+
+    def sample_lines(self, root_directory, files):
+        """
+        Yields the lines of the sampled sentences, each sentence followed by
+        a blank line, so that the result can be decoded like a split.
+        """
+        for sentence in self.sample_sentences(root_directory, files):
+            self.sample_count += 1
+            for line in StringIO(sentence):
+                yield line
+            yield "\n"
+
+    def sample_sentences(self, root_directory, files):
+        indexes = self.indexes_for(root_directory, files)
+        if self.rate is not None:
+            return self.bernoulli_sample(root_directory, files, indexes)
+        elif all(index is not None for index in indexes):
+            return self.stratified_sample(root_directory, files, indexes)
+        else:
+            return self.reservoir_sample(root_directory, files)
+
+    def indexes_for(self, root_directory, files):
+        """
+        The index used for each split, or None where the split is read
+        through. Fixed-size samples only use indexes if all splits have one.
+        """
+        indexes = [load_sentence_index(self.index_directory, root_directory, file_) for file_ in files]
+        if self.rate is None and not all(index is not None for index in indexes):
+            return [None] * len(files)
+        return indexes
+
+    def source_paths(self, root_directory, files):
+        """
+        The files the sample is read from, for a progress.ProgressTracker.
+        """
+        return [index.data_path if index is not None else os.path.join(root_directory, file_)
+                for file_, index in zip(files, self.indexes_for(root_directory, files))]
+
+    def next_gap(self):
+        """
+        Number of sentences to skip until the next sampled one, which is
+        geometrically distributed for Bernoulli sampling.
+        """
+        if self.rate >= 1.0:
+            return 0
+        return int(math.log(1.0 - self.rng.random()) / math.log(1.0 - self.rate))
+
+    def bernoulli_sample(self, root_directory, files, indexes):
+        for file_, index in zip(files, indexes):
+            file_path = os.path.join(root_directory, file_)
+            try:
+                if index is not None:
+                    self.population_count += index.sentence_count
+                    positions = []
+                    position = self.next_gap()
+                    while position < index.sentence_count:
+                        positions.append(position)
+                        position += 1 + self.next_gap()
+                    for sentence in self.read_indexed(index, positions):
+                        yield sentence
+                else:
+                    next_position = self.next_gap()
+                    with open_tracked(file_path, file_, self.progress) as raw_file, open_split(raw_file) as f:
+                        for position, sentence in enumerate(iter_sentence_texts(f, file_, self.errors, **self.limits)):
+                            self.population_count += 1
+                            if position == next_position:
+                                next_position += 1 + self.next_gap()
+                                yield sentence
+            except Exception as e:
+                self.errors.record_exception("file_error", e, file_, 0)
+
+    def stratified_sample(self, root_directory, files, indexes):
+        population_count = sum(index.sentence_count for index in indexes)
+        self.population_count += population_count
+        size = min(self.size, population_count)
+
+        # Largest remainder allocation of the sample to the splits
+        quotas = [size * index.sentence_count / float(max(population_count, 1)) for index in indexes]
+        allocation = [int(quota) for quota in quotas]
+        by_remainder = sorted(range(len(quotas)), key = lambda idx: quotas[idx] - allocation[idx], reverse = True)
+        for idx in by_remainder[:size - sum(allocation)]:
+            allocation[idx] += 1
+
+        for file_, index, split_size in zip(files, indexes, allocation):
+            positions = sorted(self.rng.sample(xrange(index.sentence_count), split_size))
+            try:
+                for sentence in self.read_indexed(index, positions):
+                    yield sentence
+            except Exception as e:
+                self.errors.record_exception("file_error", e, file_, 0)
+
+    def reservoir_sample(self, root_directory, files):
+        """
+        Reservoir sampling with geometric skips (Li's Algorithm L).
+        """
+        reservoir = []
+        weight = math.exp(math.log(self.rng.random()) / self.size)
+        next_position = self.size + int(math.log(self.rng.random()) / math.log(1.0 - weight))
+        position = 0
+        for file_ in files:
+            try:
+                with open_tracked(os.path.join(root_directory, file_), file_, self.progress) as raw_file, \
+                        open_split(raw_file) as f:
+                    for sentence in iter_sentence_texts(f, file_, self.errors, **self.limits):
+                        if position < self.size:
+                            reservoir.append((position, sentence))
+                        elif position == next_position:
+                            reservoir[self.rng.randrange(self.size)] = (position, sentence)
+                            weight *= math.exp(math.log(self.rng.random()) / self.size)
+                            next_position += 1 + int(math.log(self.rng.random()) / math.log(1.0 - weight))
+                        position += 1
+            except Exception as e:
+                self.errors.record_exception("file_error", e, file_, 0)
+        self.population_count += position
+
+        for _, sentence in sorted(reservoir):
+            yield sentence
+
+    def read_indexed(self, index, positions):
+        for sentence in index.read_sentences(positions, self.progress):
+            yield sentence
+        self.skipped_blocks += len(index.blocks) - index.blocks_read
+
+def process_sampled_splits(root_directory, processor, sampler, start_split = 0, split_num = -1, batch_size = 0,
+        progress = None, **limits):
+    """
+    Like dependency.process_sdewac_splits, but only processes the sentences
+    drawn by the sampler. Offsets of rejected sentences refer to the stream
+    of sampled sentences. A progress.ProgressTracker should be created for
+    the sampler's source_paths.
+    """
+    sampler.progress = progress
+    stream = sampler.sample_lines(root_directory, dependency.select_splits(root_directory, start_split, split_num))
+    if batch_size > 0:
+        dependency.process_conll_stream_batched(stream, processor, batch_size, "sample", **limits)
+    else:
+        dependency.process_conll_stream(stream, processor, "sample", **limits)
+
+def project_count(sample_value, sample_count, population_count, z = 1.96):
+    """
+    Projects a count observed in a sample of sentences to the population.
+    Returns the estimate and the margin of its confidence interval (z = 1.96
+    gives 95%), using the finite population correction.
+    """
+    if sample_count == 0:
+        return 0.0, float("inf")
+    proportion = sample_value / float(sample_count)
+    correction = max(1.0 - sample_count / float(max(population_count, 1)), 0.0)
+    standard_error = population_count * math.sqrt(proportion * (1.0 - proportion) / sample_count * correction)
+    return population_count * proportion, z * standard_error
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Builds the sentence indexes used for sampling")
+    parser.add_argument("indir")
+    parser.add_argument("index_dir")
+    parser.add_argument("--block-sentences", default = 32, type = int,
+            help = "Sentences per compressed block; smaller blocks allow skipping more data")
+    parser.add_argument("--max-tokens", default = dependency.MAX_TOKENS_PER_SENTENCE, type = int,
+            help = "Leave out sentences with more tokens")
+    parser.add_argument("--max-line-bytes", default = dependency.MAX_LINE_BYTES, type = int,
+            help = "Leave out sentences with longer lines")
+    parser.add_argument("--in-place", action = "store_true",
+            help = "Replace the splits in INDIR by their re-blocked copies instead of writing the copies to INDEX_DIR")
+    args = parser.parse_args()
+
+    if not args.in_place and os.path.realpath(args.index_dir) == os.path.realpath(args.indir):
+        parser.error("INDEX_DIR must differ from INDIR unless --in-place is given")
+    if args.max_tokens < 1 or args.max_line_bytes < 1:
+        parser.error("--max-tokens and --max-line-bytes must be positive")
+    if not os.path.isdir(args.index_dir):
+        os.makedirs(args.index_dir)
+    errors = dependency.ErrorReport()
+    for file_ in sorted(os.listdir(args.indir)):
+        if load_sentence_index(args.index_dir, args.indir, file_) is not None:
+            continue
+        print "Indexing {0}".format(file_)
+        split_path = os.path.join(args.indir, file_)
+        blocked_path = split_path if args.in_place else blocked_path_for(args.index_dir, file_)
+        # A copy from an earlier run would take precedence over the split
+        if args.in_place and os.path.exists(blocked_path_for(args.index_dir, file_)):
+            os.remove(blocked_path_for(args.index_dir, file_))
+        try:
+            build_sentence_index(split_path, index_path_for(args.index_dir, file_), blocked_path, args.block_sentences,
+                    errors, max_tokens = args.max_tokens, max_line_bytes = args.max_line_bytes)
+        except ValueError as e:
+            print e
+    if errors.total > 0:
+        print "Left out {0}".format(errors)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python2
+# Scores the implied sentiment towards the object of new sentences using the
+# event statistics computed by calculate_chi_squared.py.
+
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+
+from collections import OrderedDict
+from cStringIO import StringIO
+
+import dependency
+from extract_tuples import SentenceAnalyser
+from vocabulary import Vocabulary
+
+class EventScore:
+    def __init__(self, event, polarity, pmi, positive_count, negative_count):
+        self.event = event
+        self.polarity = polarity
+        self.pmi = pmi
+        self.positive_count = positive_count
+        self.negative_count = negative_count
+
+def load_score_table(filename):
+    """
+    Reads the ranking printed by calculate_chi_squared.py, i.e. lines of the
+    form "event polarity pmi [positive_count, negative_count]".
+    """
+    scores = {}
+    with open(filename) as f:
+        for line in f:
+            components = line.split()
+            if len(components) < 5:
+                continue
+            event = components[0]
+            positive_count = int(components[3].strip("[,"))
+            negative_count = int(components[4].strip("]"))
+            scores[event] = EventScore(event, components[1], float(components[2]), positive_count, negative_count)
+    return scores
+
+class ScoreTable:
+    """
+    In-memory index over the event statistics that is reloaded when the
+    underlying file changes.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.scores = {}
+        self.mtime = None
+        self.reload_count = 0
+        self.reload_listeners = []
+        self.reload()
+
+    def reload(self):
+        mtime = os.stat(self.filename).st_mtime
+        # Swapping in a complete dictionary keeps concurrent lookups consistent
+        self.scores = load_score_table(self.filename)
+        self.mtime = mtime
+        self.reload_count += 1
+        for listener in self.reload_listeners:
+            listener()
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(self.filename).st_mtime
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.reload()
+        return True
+
+    def get(self, event):
+        return self.scores.get(event)
+
+    def __len__(self):
+        return len(self.scores)
+
+class TableWatcher(threading.Thread):
+    def __init__(self, table, interval):
+        super(TableWatcher, self).__init__()
+        self.daemon = True
+        self.table = table
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.table.reload_if_changed()
+            except Exception as e:
+                print "Could not reload {0} ({1})".format(self.table.filename, e)
+
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default = None):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def no_trigger_predicate(predicate):
+    return None, None
+
+class ImplicitSentimentScorer:
+    """
+    Scores the sentiment implied towards the object of the innermost clause
+    of a sentence by looking up the polarity associated with its predicate
+    (the event).
+    """
+    def __init__(self, table, cache_size = 10000):
+        self.table = table
+        self.analyser = SentenceAnalyser(no_trigger_predicate)
+        self.cache = LRUCache(cache_size)
+        table.reload_listeners.append(self.cache.clear)
+
+    def score_event(self, event, object_entity):
+        result = {"event": event, "object": object_entity, "polarity": None}
+        score = self.table.get(event)
+        if score is not None:
+            result["polarity"] = score.polarity
+            result["pmi"] = score.pmi
+            result["positive_count"] = score.positive_count
+            result["negative_count"] = score.negative_count
+        return result
+
+    def score_sentence(self, sentence):
+        """
+        Scores a SentenceTuple as produced by SentenceAnalyser.
+        """
+        innermost = sentence
+        while innermost.is_complex_sentence:
+            innermost = innermost.object_node
+        return self.score_event(innermost.predicate_node.lemma, innermost.object_node.word)
+
+    def score_conll(self, conll_text):
+        """
+        Scores a single sentence in the CoNLL 2009 format used for sdewac.
+        Returns None if no subject/object structure could be found.
+        """
+        # Entries are keyed by the table they were scored against: a reload
+        # clears the cache, but a sentence scored against the old table while
+        # it happens could otherwise be cached after the clear
+        key = (self.table.reload_count, conll_text)
+        result = self.cache.get(key, self)
+        if result is not self:
+            return result
+
+        result = None
+        # A vocabulary per sentence, since the shared one is never trimmed
+        root_nodes = dependency.decode_conll_parse(StringIO(conll_text.strip() + "\n\n"),
+                vocabulary = Vocabulary())
+        if root_nodes:
+            longest_node = max(root_nodes, key = lambda n: n.child_count)
+            sentence = self.analyser.analyse_sentence(longest_node)
+            if sentence:
+                result = self.score_sentence(sentence)
+
+        self.cache.put(key, result)
+        return result
+
+    def score_request(self, request):
+        """
+        Scores a request of the form {"conll": text or [texts]} or
+        {"tuples": [{"event": lemma, "object": word}, ...]}.
+        """
+        results = []
+        conll = request.get("conll", [])
+        if isinstance(conll, basestring):
+            conll = [conll]
+        for conll_text in conll:
+            results.append(self.score_conll(conll_text))
+        for tuple_ in request.get("tuples", []):
+            results.append(self.score_event(tuple_["event"], tuple_.get("object")))
+        return results
+
+    @property
+    def statistics(self):
+        return {"events": len(self.table),
+                "reloads": self.table.reload_count,
+                "cache_size": len(self.cache.entries),
+                "cache_hits": self.cache.hits,
+                "cache_misses": self.cache.misses}
+
+class ScoringRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send each response in one write; it is flushed after every request
+    wbufsize = -1
+
+    def do_POST(self):
+        if self.path != "/score":
+            self.send_json(404, {"error": "Unknown path {0}".format(self.path)})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+            results = self.server.scorer.score_request(request)
+        except Exception as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(200, {"results": results})
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.server.scorer.statistics)
+        else:
+            self.send_json(404, {"error": "Unknown path {0}".format(self.path)})
+
+    def send_json(self, code, value):
+        body = json.dumps(value)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ScoringHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, client_address = BaseHTTPServer.HTTPServer.get_request(self)
+        request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return request, client_address
+
+class UnixScoringHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = SocketServer.UnixStreamServer.get_request(self)
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("unix", 0)
+
+def create_server(scorer, port = None, unix_socket = None):
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixScoringHTTPServer(unix_socket, ScoringRequestHandler)
+    else:
+        server = ScoringHTTPServer(("127.0.0.1", port), ScoringRequestHandler)
+    server.scorer = scorer
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves implicit sentiment scores over HTTP")
+    parser.add_argument("chi_values_file")
+    parser.add_argument("--port", default = 8411, type = int)
+    parser.add_argument("--unix-socket", default = None,
+            help = "Listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--cache-size", default = 10000, type = int)
+    parser.add_argument("--reload-interval", default = 5.0, type = float,
+            help = "Seconds between checks for changes of the statistics file")
+    args = parser.parse_args()
+
+    table = ScoreTable(args.chi_values_file)
+    scorer = ImplicitSentimentScorer(table, args.cache_size)
+    TableWatcher(table, args.reload_interval).start()
+
+    server = create_server(scorer, args.port, args.unix_socket)
+    print "Serving {0} events on {1}".format(len(table), args.unix_socket or "port {0}".format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,85 @@
+# Corpus-wide string interning. Words, lemmas, POS tags and relation labels
+# are stored once and referred to by integer ids everywhere else.
+
+class Vocabulary:
+    def __init__(self, reserved = None):
+        self.strings = []
+        self.ids = {}
+        if reserved is None:
+            reserved = RESERVED_STRINGS
+        for string in reserved:
+            self.add(string)
+
+    def add(self, string):
+        """
+        Returns the id of the string, adding it if it is new.
+        """
+        try:
+            return self.ids[string]
+        except KeyError:
+            id_ = len(self.strings)
+            self.ids[string] = id_
+            self.strings.append(string)
+            return id_
+
+    def lookup(self, string, default = None):
+        """
+        Returns the id of the string without adding it.
+        """
+        return self.ids.get(string, default)
+
+    def intern(self, string):
+        """
+        Returns the canonical copy of the string.
+        """
+        return self.strings[self.add(string)]
+
+    def resolve(self, value):
+        """
+        Maps an id, or a tuple of ids, back to strings.
+        """
+        if isinstance(value, tuple):
+            return tuple(self.strings[id_] for id_ in value)
+        return self.strings[value]
+
+    def merge(self, other):
+        """
+        Adds all strings of another vocabulary (e.g. from a parallel worker)
+        and returns a list that maps the ids of the other vocabulary to ids
+        in this one.
+        """
+        return [self.add(string) for string in other.strings]
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            for string in self.strings:
+                f.write(string)
+                f.write("\n")
+
+    @classmethod
+    def load(cls, filename):
+        vocabulary = cls(reserved = [])
+        with open(filename) as f:
+            for line in f:
+                vocabulary.add(line.rstrip("\n"))
+        for id_, string in enumerate(RESERVED_STRINGS):
+            if vocabulary.lookup(string) != id_:
+                raise ValueError("{0} does not start with the reserved strings".format(filename))
+        return vocabulary
+
+    def __getitem__(self, id_):
+        return self.strings[id_]
+
+    def __contains__(self, string):
+        return string in self.ids
+
+    def __len__(self):
+        return len(self.strings)
+
+# Labels and tags the analysis compares against. They are added first to
+# every vocabulary so that their ids are the same in all processes.
+RESERVED_STRINGS = ["--", "SB", "OA", "OC", "MO", "NE", "PPER", "PRF", "ADV", "PTKNEG"]
+(NO_LABEL, LABEL_SB, LABEL_OA, LABEL_OC, LABEL_MO,
+        POS_NE, POS_PPER, POS_PRF, POS_ADV, POS_PTKNEG) = range(len(RESERVED_STRINGS))
+
+VOCABULARY = Vocabulary()